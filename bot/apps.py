@@ -1,9 +1,13 @@
-from apscheduler.executors.pool import ThreadPoolExecutor
-from apscheduler.schedulers.background import BackgroundScheduler
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
+
 
-# タスクの確認間隔
-TASK_CHECK_INTERVAL = (0, 10)
+def is_running_management_command()->bool:
+    '''Webサーバー(開発用サーバーを除く)以外の管理コマンドとして起動されたかどうか'''
+    return os.path.basename(sys.argv[0]) == "manage.py" and len(sys.argv) > 1 and sys.argv[1] != "runserver"
 
 
 class BotConfig(AppConfig):
@@ -12,21 +16,9 @@ class BotConfig(AppConfig):
     def ready(self):
         '''アプリ起動時の処理'''
         super(BotConfig, self).ready()
+        # 定期ジョブはWebサーバーのプロセス内で実行する設定の場合のみ開始する。管理コマンドでは開始しない
+        if not settings.ENABLE_IN_PROCESS_SCHEDULER or is_running_management_command():
+            return
         # modelsのインポートはdjangoの初期化前に行えないので個々で行う
-        from .task_check import TaskChecker, TaskCheckType
-
-        def task_check_job():
-            '''明日のタスクのリマインドや確認を行うジョブ'''
-            TaskChecker.execute(TaskCheckType.All)
-            print("job_executed")
-
-        # Executorの数を制限しないとデータベースの接続数が増えて上限にひっかかる
-        executors = {
-            'default': ThreadPoolExecutor(1),
-        }
-        scheduler = BackgroundScheduler(executors=executors)
-        # タスクの定期確認
-        scheduler.add_job(task_check_job, "interval",
-                          hours=TASK_CHECK_INTERVAL[0], minutes=TASK_CHECK_INTERVAL[1])
-
-        scheduler.start()
+        from .task_scheduler import create_scheduler
+        create_scheduler().start()
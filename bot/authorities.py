@@ -15,3 +15,14 @@ class UserAuthority(Enum):
     def check(self, required)->bool:
         '''権限が満たされているか確認'''
         return self.value <= required.value
+
+
+# 権限とデータベースに保存するコードの対応。変更する場合は保存済みのデータを移行する必要がある
+USER_AUTHORITY_CODE_MAP = {
+    UserAuthority.Master: 0,
+    UserAuthority.Editor: 1,
+    UserAuthority.Watcher: 2,
+}
+# データベースに保存するコードと権限の対応
+CODE_USER_AUTHORITY_MAP = {code: authority for authority,
+                           code in USER_AUTHORITY_CODE_MAP.items()}
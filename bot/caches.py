@@ -0,0 +1,105 @@
+'''キャッシュ関連のクラス'''
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class TTLCache(object):
+    '''有効期限付きのスレッドセーフなキャッシュ。
+    容量を超えたら最も長い間使われていないものから破棄する。有効期限は秒で指定する。'''
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        '''値を取得する。ないか期限切れならデフォルト値を返す'''
+        with self.__lock:
+            item = self.__items.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self.__items[key]
+                return default
+            self.__items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float=None):
+        '''値を設定する。有効期限を指定しない場合はキャッシュの有効期限を用いる'''
+        with self.__lock:
+            self.__set(key, value, ttl)
+
+    def add(self, key, value, ttl: float=None)->bool:
+        '''キーがない(又は期限切れの)場合のみ値を設定する。戻り値は設定したかどうか'''
+        with self.__lock:
+            item = self.__items.get(key)
+            if item is not None and item[1] > time.monotonic():
+                return False
+            self.__set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        '''値を削除する'''
+        with self.__lock:
+            self.__items.pop(key, None)
+
+    def clear(self):
+        '''全ての値を削除する'''
+        with self.__lock:
+            self.__items.clear()
+
+    def __contains__(self, key)->bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __set(self, key, value, ttl):
+        '''ロックを取得した状態で値を設定する'''
+        self.__items[key] = (value, time.monotonic() +
+                             (self.ttl if ttl is None else ttl))
+        self.__items.move_to_end(key)
+        while len(self.__items) > self.max_size:
+            self.__items.popitem(last=False)
+
+
+class LRUCache(TTLCache):
+    '''有効期限のないスレッドセーフなキャッシュ。
+    容量を超えたら最も長い間使われていないものから破棄する。'''
+
+    def __init__(self, max_size: int):
+        super().__init__(max_size, float("inf"))
+
+
+class SingleFlight(object):
+    '''同じキーでの同時呼び出しをまとめるクラス。
+    実行中の呼び出しがあれば新たに実行せず、その結果(例外を含む)を共有する。'''
+
+    def __init__(self):
+        self.__calls = {}
+        self.__lock = threading.Lock()
+
+    def do(self, key, func):
+        '''キーに対応する呼び出しを実行して結果を返す'''
+        with self.__lock:
+            call = self.__calls.get(key)
+            is_owner = call is None
+            if is_owner:
+                call = Future()
+                self.__calls[key] = call
+        if not is_owner:
+            return call.result()
+
+        try:
+            call.set_result(func())
+        except BaseException as error:
+            call.set_exception(error)
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+        return call.result()
+
+
+_MISSING = object()
@@ -0,0 +1,57 @@
+'''現在日時を取得する時計。シミュレーションでは仮想時計に差し替えて時間を進める'''
+
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from .utilities import TIMEZONE_DEFAULT
+
+
+class SystemClock(object):
+    '''システムの現在日時を返す時計'''
+
+    def now(self)->datetime:
+        '''現在日時を取得する'''
+        return datetime.now(TIMEZONE_DEFAULT)
+
+
+class VirtualClock(object):
+    '''指定した日時から始まり、明示的に進めたときだけ進む時計'''
+
+    def __init__(self, start: datetime):
+        self.__now = start.astimezone(TIMEZONE_DEFAULT)
+
+    def now(self)->datetime:
+        '''現在日時を取得する'''
+        return self.__now
+
+    def advance_to(self, date_time: datetime):
+        '''指定日時まで進める。過去の日時を指定した場合は進めない'''
+        self.__now = max(self.__now, date_time.astimezone(TIMEZONE_DEFAULT))
+
+    def advance(self, delta: timedelta):
+        '''指定時間だけ進める'''
+        self.advance_to(self.__now + delta)
+
+
+__clock = SystemClock()
+__clock_lock = threading.Lock()
+
+
+def get_current_datetime()->datetime:
+    '''使用中の時計の現在日時を取得する'''
+    return __clock.now()
+
+
+@contextmanager
+def use_clock(clock):
+    '''範囲内で使用する時計を差し替える。スケジューラのスレッドなど、プロセス全体に影響する'''
+    global __clock
+    with __clock_lock:
+        previous_clock = __clock
+        __clock = clock
+    try:
+        yield clock
+    finally:
+        with __clock_lock:
+            __clock = previous_clock
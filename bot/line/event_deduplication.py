@@ -0,0 +1,111 @@
+'''LINEイベントの重複処理防止。
+LINEは応答が遅いとWebhookを再送するので、処理済みのイベントを覚えておいて同じイベントを二度処理しないようにする。
+処理を始める時に期限付きの処理中として記録し、処理に成功したら処理済みとして記録する。
+処理中にプロセスが落ちた場合は、期限が過ぎればLINEの再送やWebhookキューの再取得で処理し直せる。'''
+
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+
+from django.db import IntegrityError, transaction
+
+from ..caches import TTLCache
+from ..models import ProcessedWebhookEvent
+from . import line_settings
+from .line_utilities import get_event_source_key
+
+# 処理済みイベントを覚えておく期間
+PROCESSED_EVENT_TTL = timedelta(hours=1)
+# プロセス内で覚えておく処理済みイベントの最大数
+LOCAL_CACHE_SIZE = 10000
+# データベースから期限切れの処理済みイベントを削除する間隔
+DATABASE_CLEANUP_INTERVAL = timedelta(minutes=10)
+# 処理中として記録したイベントを、他のプロセスが引き継げるようになるまでの期間。
+# Webhookキューで落ちたワーカーのアイテムが再取得された時に引き継げるように、webhook_queue.LOCK_DURATIONより短くする
+EVENT_PROCESSING_LOCK_DURATION = timedelta(minutes=2)
+
+__local_processed_events = TTLCache(
+    LOCAL_CACHE_SIZE, PROCESSED_EVENT_TTL.total_seconds())
+__database_cleanup_lock = threading.Lock()
+__last_database_cleanup_datetime = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def set_webhook_event_ids(events: list, body: str):
+    '''SDKが読み捨てるwebhookEventIdをリクエストボディから読み取ってイベントに設定する。
+    SDKは対応していない種類のイベントを読み飛ばすので、種類とタイムスタンプが一致するものを順番に対応付ける'''
+    raw_events = iter(json.loads(body).get("events", []))
+    for event in events:
+        for raw_event in raw_events:
+            if raw_event.get("type") == event.type and raw_event.get("timestamp") == event.timestamp:
+                event.webhook_event_id = raw_event.get("webhookEventId")
+                break
+
+
+def get_event_id(event)->str:
+    '''イベントの識別子を取得する。
+    webhookEventIdが取得できればそれを、できなければ返信トークンとタイムスタンプから作成する'''
+    # webhookEventIdはset_webhook_event_idsで設定されている。古いLINEのWebhookには含まれない
+    webhook_event_id = getattr(event, "webhook_event_id", None)
+    if webhook_event_id:
+        return webhook_event_id
+    reply_token = getattr(event, "reply_token", None)
+    if reply_token:
+        return "{}:{}".format(reply_token, event.timestamp)
+    # 退出イベントなど返信トークンがないイベントは種類と送信元とタイムスタンプで識別する
+    return "{}:{}:{}".format(event.type, get_event_source_key(event), event.timestamp)
+
+
+def mark_event_as_processing(event)->bool:
+    '''イベントを処理中として記録する。戻り値は処理を始めてよいかどうか。処理済みか他で処理中のイベントはFalse。
+    共有の重複防止が有効な場合はデータベースにも記録し、他のプロセスで処理済み又は処理中のイベントも検出する'''
+    event_id = get_event_id(event)
+    if not __local_processed_events.add(event_id, True):
+        return False
+    if line_settings.ENABLE_SHARED_EVENT_DEDUPLICATION and not try_mark_shared_event_as_processing(event_id):
+        # 他のプロセスが落ちた場合に、このプロセスへの再送で引き継げるようにプロセス内の記録は残さない
+        __local_processed_events.delete(event_id)
+        return False
+    return True
+
+
+def try_mark_shared_event_as_processing(event_id: str)->bool:
+    '''データベースにイベントを処理中として記録する。処理済みか、他で処理中で期限内ならFalse'''
+    now = datetime.now(timezone.utc)
+    processing_until = now + EVENT_PROCESSING_LOCK_DURATION
+    try:
+        with transaction.atomic():
+            ProcessedWebhookEvent.objects.create(
+                event_id=event_id, processing_until=processing_until)
+    except IntegrityError:
+        # 処理中のままプロセスが落ちるなどして期限が過ぎていたら引き継ぐ
+        return bool(ProcessedWebhookEvent.objects.filter(event_id=event_id, processing_until__lte=now).update(
+            processing_until=processing_until))
+    delete_expired_processed_events_if_need()
+    return True
+
+
+def mark_event_as_processed(event):
+    '''処理に成功したイベントを処理済みとして記録する'''
+    if line_settings.ENABLE_SHARED_EVENT_DEDUPLICATION:
+        ProcessedWebhookEvent.objects.filter(event_id=get_event_id(event)).update(
+            processing_until=None, processed_at=datetime.now(timezone.utc))
+
+
+def unmark_event(event):
+    '''処理に失敗したイベントの記録を取り消し、LINEの再送で処理し直せるようにする'''
+    event_id = get_event_id(event)
+    __local_processed_events.delete(event_id)
+    if line_settings.ENABLE_SHARED_EVENT_DEDUPLICATION:
+        ProcessedWebhookEvent.objects.filter(event_id=event_id).delete()
+
+
+def delete_expired_processed_events_if_need():
+    '''前回から一定時間経っていたら、データベースから期限切れの処理済みイベントを削除する'''
+    global __last_database_cleanup_datetime
+    now = datetime.now(timezone.utc)
+    with __database_cleanup_lock:
+        if now - __last_database_cleanup_datetime < DATABASE_CLEANUP_INTERVAL:
+            return
+        __last_database_cleanup_datetime = now
+    ProcessedWebhookEvent.objects.filter(
+        processed_at__lt=now - PROCESSED_EVENT_TTL).delete()
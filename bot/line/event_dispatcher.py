@@ -0,0 +1,104 @@
+'''LINEイベントのディスパッチャ'''
+
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import linebot
+from django.db import close_old_connections
+
+from . import event_deduplication
+from .line_utilities import get_event_source_key
+
+# イベント処理の最大並列数。増やしすぎるとデータベースの接続数上限にひっかかる
+MAX_WORKER_COUNT = 4
+
+
+class OrderedParallelWebhookHandler(linebot.WebhookHandler):
+    '''送信元が異なるイベントは並列に、送信元が同じイベントは受信順に処理するWebhookHandler。
+    同じ送信元のイベントは、別々のWebhookで同時に届いた場合もこのプロセス内では同時には処理しない。
+    ただしロックは到着順に取得されるとは限らないので、別々のWebhookの間の順番はWebhookキュー(webhook_queue)を使う場合のみ守られる。'''
+
+    def __init__(self, channel_secret, max_worker_count=MAX_WORKER_COUNT):
+        super(OrderedParallelWebhookHandler, self).__init__(channel_secret)
+        self.__executor = ThreadPoolExecutor(max_worker_count)
+        # 送信元ごとのロック。使われなくなったロックは自動で破棄される
+        self.__source_locks = weakref.WeakValueDictionary()
+        self.__source_locks_guard = threading.Lock()
+
+    def handle(self, body, signature):
+        '''Webhookを処理する。いずれかのイベントの処理で例外が発生した場合は全ての処理が終わってから送出する'''
+        events = self.parser.parse(body, signature)
+        event_deduplication.set_webhook_event_ids(events, body)
+        # 送信元ごとに受信順を保ってイベントをまとめる
+        source_events_map = OrderedDict()
+        for event in events:
+            source_events_map.setdefault(
+                get_event_source_key(event), []).append(event)
+
+        # 送信元が一つだけなら呼び出し元のスレッドでそのまま処理する
+        if len(source_events_map) <= 1:
+            for source_key, source_events in source_events_map.items():
+                self.__handle_source_events(source_key, source_events)
+            return
+
+        futures = [self.__executor.submit(self.__handle_source_events_in_worker, source_key, source_events)
+                   for source_key, source_events in source_events_map.items()]
+        errors = [future.exception() for future in futures]
+        errors = [error for error in errors if error is not None]
+        if errors:
+            if len(errors) > 1:
+                sys.stderr.write("複数の送信元のイベント処理でエラーが発生しました。({})\n".format(
+                    ", ".join([str(error) for error in errors])))
+            raise errors[0]
+
+    def __handle_source_events_in_worker(self, source_key, source_events):
+        '''ワーカースレッドで同じ送信元のイベントを順番に処理する'''
+        # ワーカースレッドはリクエストをまたいで使い回されるので、データベース接続を自分で管理する
+        close_old_connections()
+        try:
+            self.__handle_source_events(source_key, source_events)
+        finally:
+            close_old_connections()
+
+    def __handle_source_events(self, source_key, source_events):
+        '''同じ送信元のイベントを順番に処理する'''
+        with self.__get_source_lock(source_key):
+            for event in source_events:
+                # 再送などで処理済み又は他で処理中のイベントは無視する
+                if not event_deduplication.mark_event_as_processing(event):
+                    print("処理済みか処理中のイベント({})を無視しました。".format(
+                        event_deduplication.get_event_id(event)))
+                    continue
+                handler = self.__get_handler(event)
+                try:
+                    if handler is not None:
+                        handler(event)
+                except Exception:
+                    # 処理に失敗したイベントは、LINEの再送で処理し直せるように記録を取り消す
+                    event_deduplication.unmark_event(event)
+                    raise
+                event_deduplication.mark_event_as_processed(event)
+
+    def __get_source_lock(self, source_key)->threading.Lock:
+        '''送信元のロックを取得する'''
+        with self.__source_locks_guard:
+            source_lock = self.__source_locks.get(source_key)
+            if source_lock is None:
+                source_lock = threading.Lock()
+                self.__source_locks[source_key] = source_lock
+            return source_lock
+
+    def __get_handler(self, event):
+        '''イベントのハンドラを取得する。WebhookHandler.handleと同じ規則で探す'''
+        handler = None
+        if isinstance(event, linebot.models.MessageEvent):
+            handler = self._handlers.get("{}_{}".format(
+                event.__class__.__name__, event.message.__class__.__name__))
+        if handler is None:
+            handler = self._handlers.get(event.__class__.__name__)
+        if handler is None:
+            handler = self._default
+        return handler
@@ -7,6 +7,8 @@ from django.db.utils import OperationalError
 
 from . import line_utilities as line_util
 from . import line_settings
+from .event_dispatcher import OrderedParallelWebhookHandler
+from .outbound_messages import ReplyMessageBuilder
 from .. import message_commands as mess_cmd
 from .. import utilities as util
 from ..exceptions import GroupNotFoundError, UserNotFoundError
@@ -14,7 +16,7 @@ from ..exceptions import GroupNotFoundError, UserNotFoundError
 COMMAND_TRIGGER_LIST = ["#", "＃"]
 SENTENCE_MAX_LENGTH = 64
 
-event_handler = linebot.WebhookHandler(line_settings.CHANNEL_SECRET)
+event_handler = OrderedParallelWebhookHandler(line_settings.CHANNEL_SECRET)
 
 
 @event_handler.add(linebot.models.FollowEvent)
@@ -60,6 +62,8 @@ def text_message_handler(event):
             super(Reject, self).__init__()
             self.message = message
 
+    # 通知とコマンドの返信は一回の返信でまとめて送信する
+    reply_message_builder = ReplyMessageBuilder(event.reply_token)
     try:
         message_text = util.unify_newline_code(event.message.text)
         # コマンドとパラメータの取得
@@ -100,6 +104,11 @@ def text_message_handler(event):
         if command and util.ENABLE_MAINTENANCE_MODE:
             raise Reject("メンテナンス中です。。。")
 
+        # コマンドでないグループのメッセージで、送信者がメンバー登録済みと分かっているなら何もしない
+        if not command and event.source.type == "group" and line_util.is_known_group_member(
+                event.source.group_id, event.source.user_id):
+            return
+
         # メッセージ送信グループをデータベースから検索し、なかったら作成
         try:
             source_group = line_util.get_group_by_line_group_id_from_database(
@@ -115,8 +124,7 @@ def text_message_handler(event):
             if source_group:
                 if line_util.add_member_to_group_if_need(source_user, source_group):
                     # メンバーの追加を通知
-                    line_settings.api.push_message(
-                        source_group.line_group.group_id,
+                    reply_message_builder.add(
                         linebot.models.TextSendMessage(text="このグループ「{}」にユーザー「{}」を追加しました。".format(source_group.name, source_user.name)))
         except UserNotFoundError:
             try:
@@ -124,15 +132,13 @@ def text_message_handler(event):
                     source_user = line_util.register_user_by_line_user_id_in_group(
                         event.source.user_id, event.source.group_id)
                     # メンバーの追加を通知
-                    line_settings.api.push_message(
-                        source_group.line_group.group_id,
+                    reply_message_builder.add(
                         linebot.models.TextSendMessage(text="このグループ「{}」にユーザー「{}」を追加しました。".format(source_group.name, source_user.name)))
                 else:
                     source_user = line_util.register_user_by_line_user_id(
                         event.source.user_id)
                     # ユーザーの登録を通知
-                    line_settings.api.push_message(
-                        source_user.line_user.user_id,
+                    reply_message_builder.add(
                         linebot.models.TextSendMessage(text="あなた「{}」をユーザー登録しました。".format(source_user.name)))
 
             except linebot.exceptions.LineBotApiError:
@@ -150,26 +156,27 @@ def text_message_handler(event):
             # グループの時は宛先を表示
             if source_group:
                 reply = "@{}\n{}".format(source_user.name, reply)
-            line_settings.api.reply_message(
-                event.reply_token,
+            reply_message_builder.add(
                 linebot.models.TextSendMessage(text=reply))
+        # 通知だけの場合も返信する
+        reply_message_builder.send(line_settings.api)
     except Reject as reject:
-        line_settings.api.reply_message(
-            event.reply_token,
+        reply_message_builder.add(
             linebot.models.TextSendMessage(text=reject.message))
+        reply_message_builder.send(line_settings.api)
         return
     except OperationalError:
         sys.stderr.write(
             "データベース操作でエラーが発生しました。({})\n".format(sys.exc_info()[1]))
-        line_settings.api.reply_message(
-            event.reply_token,
+        reply_message_builder.add(
             linebot.models.TextSendMessage(text="内部エラー(データベース操作でエラーが発生)"))
+        reply_message_builder.send(line_settings.api)
         raise
     except Exception:
         try:
-            line_settings.api.reply_message(
-                event.reply_token,
+            reply_message_builder.add(
                 linebot.models.TextSendMessage(text="なんかこっち側で謎の問題が起こった。"))
+            reply_message_builder.send(line_settings.api)
         except Exception:
             pass
         raise
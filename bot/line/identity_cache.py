@@ -0,0 +1,97 @@
+'''LINEのIDとユーザー・グループの主キーの対応、およびグループのメンバー関係のキャッシュ。
+行そのもの(権限など)はキャッシュせず、必要なときにデータベースから主キーで読み込む。
+モデルの保存と削除のシグナルで無効化する。'''
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from ..caches import TTLCache
+from ..models import Group, LineGroup, LineUser, User
+
+# キャッシュしておくユーザー、グループ、メンバー関係それぞれの最大数
+CACHE_SIZE = 10000
+# キャッシュの有効期限(秒)。他のプロセスでのメンバー関係の変更はこの期間内に反映される
+CACHE_TTL = 60
+
+# LINEユーザーID -> UserのID
+__user_ids = TTLCache(CACHE_SIZE, CACHE_TTL)
+# LINEグループID -> GroupのID
+__group_ids = TTLCache(CACHE_SIZE, CACHE_TTL)
+# メンバーであることが確認済みの(GroupのID, UserのID)
+__group_members = TTLCache(CACHE_SIZE, CACHE_TTL)
+
+
+def get_user_id(line_user_id: str)->int:
+    '''LINEユーザーIDに対応するユーザーのIDをキャッシュから取得する。なければNone'''
+    return __user_ids.get(line_user_id)
+
+
+def set_user_id(line_user_id: str, user_id: int):
+    '''LINEユーザーIDに対応するユーザーのIDをキャッシュする'''
+    __user_ids.set(line_user_id, user_id)
+
+
+def get_group_id(line_group_id: str)->int:
+    '''LINEグループIDに対応するグループのIDをキャッシュから取得する。なければNone'''
+    return __group_ids.get(line_group_id)
+
+
+def set_group_id(line_group_id: str, group_id: int):
+    '''LINEグループIDに対応するグループのIDをキャッシュする'''
+    __group_ids.set(line_group_id, group_id)
+
+
+def is_group_member(group_id: int, user_id: int)->bool:
+    '''ユーザーがグループのメンバーであることがキャッシュされているかどうか'''
+    return (group_id, user_id) in __group_members
+
+
+def set_group_member(group_id: int, user_id: int):
+    '''ユーザーがグループのメンバーであることをキャッシュする'''
+    __group_members.set((group_id, user_id), True)
+
+
+def is_known_group_member(line_group_id: str, line_user_id: str)->bool:
+    '''LINEユーザーがLINEグループのメンバーであることがキャッシュされているかどうか'''
+    group_id = get_group_id(line_group_id)
+    user_id = get_user_id(line_user_id)
+    if group_id is None or user_id is None:
+        return False
+    return is_group_member(group_id, user_id)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Group)
+def __invalidate_group_members(sender, instance, **kwargs):
+    '''ユーザーかグループが削除されたらメンバー関係を全て無効化する'''
+    __group_members.clear()
+
+
+@receiver(post_save, sender=LineUser)
+@receiver(post_delete, sender=LineUser)
+def __invalidate_line_user(sender, instance, **kwargs):
+    '''LINEユーザーが変更されたらキャッシュを無効化する'''
+    __user_ids.delete(instance.user_id)
+
+
+@receiver(post_save, sender=LineGroup)
+@receiver(post_delete, sender=LineGroup)
+def __invalidate_line_group(sender, instance, **kwargs):
+    '''LINEグループが変更されたらキャッシュを無効化する'''
+    __group_ids.delete(instance.group_id)
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def __update_group_members(sender, instance, action, reverse, pk_set, **kwargs):
+    '''グループのメンバーが変更されたらキャッシュを更新する'''
+    if action == "post_clear":
+        __group_members.clear()
+    elif action in ("post_add", "post_remove"):
+        # reverseの場合はinstanceがユーザーでpk_setがグループのIDになる
+        pairs = [(pk, instance.id) if reverse else (instance.id, pk)
+                 for pk in pk_set]
+        for group_id, user_id in pairs:
+            if action == "post_add":
+                set_group_member(group_id, user_id)
+            else:
+                __group_members.delete((group_id, user_id))
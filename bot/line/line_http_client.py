@@ -0,0 +1,143 @@
+'''LINE Messaging APIとの通信に用いるHTTPクライアント'''
+
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+from requests.adapters import HTTPAdapter
+
+# 接続プールで保持するLINEのサーバーへの最大接続数。全スレッドで共有する
+CONNECTION_POOL_SIZE = 10
+# 再試行の最大回数の既定値
+MAX_RETRY_COUNT = 3
+# 再試行までの待ち時間の基準(秒)。再試行ごとに倍になり、その範囲でランダムに待つ
+RETRY_BACKOFF_BASE = 0.5
+# 再試行までの最大待ち時間(秒)。Retry-Afterで指定された場合もこれ以上は待たない
+RETRY_BACKOFF_MAX = 30
+# 再試行するレスポンスのステータスコード
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# 再試行キー(X-Line-Retry-Key)を付けて二重送信を防ぐAPIのパス
+RETRY_KEY_PATHS = ("/v2/bot/message/push", "/v2/bot/message/multicast")
+
+__session = None
+__session_lock = threading.Lock()
+__retry_key_context = threading.local()
+
+
+def get_session()->requests.Session:
+    '''接続プールを持つ共有のセッションを取得する'''
+    global __session
+    with __session_lock:
+        if __session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=CONNECTION_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            __session = session
+        return __session
+
+
+@contextmanager
+def use_retry_key(retry_key: str):
+    '''このスレッドでのプッシュ送信に指定した再試行キーを付ける。
+    送信処理自体をやり直す場合にも同じキーを使うことで、二重送信を防ぐ'''
+    __retry_key_context.retry_key = retry_key
+    try:
+        yield
+    finally:
+        __retry_key_context.retry_key = None
+
+
+def get_retry_key()->str:
+    '''プッシュ送信に付ける再試行キーを取得する。指定されていなければ新しく作成する'''
+    return getattr(__retry_key_context, "retry_key", None) or str(uuid.uuid4())
+
+
+def get_retry_wait_seconds(retry_count: int, response: requests.Response = None)->float:
+    '''再試行までの待ち時間を取得する。
+    Retry-Afterが指定されていればそれに従い、なければジッター付きの指数バックオフで決める'''
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            wait_seconds = float(retry_after)
+        except ValueError:
+            try:
+                wait_seconds = (parsedate_to_datetime(
+                    retry_after) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                wait_seconds = None
+        if wait_seconds is not None:
+            return min(max(wait_seconds, 0), RETRY_BACKOFF_MAX)
+    return random.uniform(0, min(RETRY_BACKOFF_BASE * 2 ** retry_count, RETRY_BACKOFF_MAX))
+
+
+def is_request_not_sent(error: requests.RequestException)->bool:
+    '''リクエストがサーバーに送られる前に失敗したかどうか'''
+    return isinstance(error, requests.ConnectTimeout)
+
+
+class PooledRetryingHttpClient(RequestsHttpClient):
+    '''接続プールを全スレッドで共有し、一時的なエラー(接続エラー、タイムアウト、429、5xx)を再試行するHTTPクライアント。
+    プッシュ送信には再試行キーを付けて、再試行による二重送信を防ぐ。
+    返信など再試行キーを付けられないPOSTは、前の試行が受け付けられていると二重に処理されたり(返信トークンは一度しか使えないので)失敗したりするため、
+    リクエストが送られる前に失敗した場合(接続のタイムアウト)のみ再試行する。'''
+
+    def __init__(self, timeout=RequestsHttpClient.DEFAULT_TIMEOUT, max_retry_count: int=MAX_RETRY_COUNT):
+        super(PooledRetryingHttpClient, self).__init__(timeout)
+        self.max_retry_count = max_retry_count
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        '''GETリクエストを送信する'''
+        response = self.__request(
+            "GET", url, headers, timeout, params=params, stream=stream)
+        return RequestsHttpResponse(response)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        '''POSTリクエストを送信する'''
+        response = self.__request("POST", url, headers, timeout, data=data)
+        return RequestsHttpResponse(response)
+
+    def __request(self, method, url, headers, timeout, **kwargs)->requests.Response:
+        '''必要なら再試行しながらリクエストを送信する'''
+        headers = dict(headers) if headers else {}
+        if method == "POST" and any(url.endswith(path) for path in RETRY_KEY_PATHS):
+            headers.setdefault("X-Line-Retry-Key", get_retry_key())
+        # 何度送っても結果が変わらないリクエストだけ、送信後の失敗でも再試行する
+        is_retry_safe = method == "GET" or "X-Line-Retry-Key" in headers
+        if timeout is None:
+            timeout = self.timeout
+
+        retry_count = 0
+        while True:
+            try:
+                response = get_session().request(
+                    method, url, headers=headers, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                error = sys.exc_info()[1]
+                if retry_count >= self.max_retry_count or not (is_retry_safe or is_request_not_sent(error)):
+                    raise
+                error_str = str(error)
+                wait_seconds = get_retry_wait_seconds(retry_count)
+            else:
+                # 再試行キーを付けた再試行で409が返ってきたら、前の試行が受け付けられている。
+                # ステータスコードは書き換えずに返し、送信済みとして扱うかは呼び出し元が判断する
+                if retry_count > 0 and response.status_code == 409 and "X-Line-Retry-Key" in headers:
+                    print("LINE APIへのリクエスト({} {})は前の試行で受け付けられていました(再試行キー: {})。".format(
+                        method, url, headers["X-Line-Retry-Key"]))
+                    return response
+                if response.status_code not in RETRY_STATUS_CODES or retry_count >= self.max_retry_count or not is_retry_safe:
+                    return response
+                error_str = "ステータスコード{}".format(response.status_code)
+                wait_seconds = get_retry_wait_seconds(retry_count, response)
+            retry_count += 1
+            sys.stderr.write("LINE APIへのリクエスト({} {})が失敗しました({})。{:.1f}秒後に再試行します({}/{})。\n".format(
+                method, url, error_str, wait_seconds, retry_count, self.max_retry_count))
+            time.sleep(wait_seconds)
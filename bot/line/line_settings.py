@@ -2,9 +2,13 @@
 
 import os
 import sys
+from functools import partial
 
 import linebot
 
+from ..utilities import get_bool_from_environment, get_number_from_environment
+from .line_http_client import MAX_RETRY_COUNT, PooledRetryingHttpClient
+
 try:
     ACCESS_TOKEN = os.environ["LBOT_LINE_ACCESS_TOKEN"]
     CHANNEL_SECRET = os.environ["LBOT_LINE_CHANNEL_SECRET"]
@@ -15,4 +19,18 @@ except KeyError:
         'LINEにアクセスするためには環境変数としてLINE_SCCESS_TOKENとLINE_CHANNEL_SECRETが必要です。')
 
 
-api = linebot.LineBotApi(ACCESS_TOKEN)
+# Webhookをキューに積んで非同期に処理するかどうか
+ENABLE_ASYNC_WEBHOOK = get_bool_from_environment("LBOT_ENABLE_ASYNC_WEBHOOK")
+# 処理済みイベントをデータベースにも記録して、複数のプロセス間でイベントの重複処理を防ぐかどうか
+ENABLE_SHARED_EVENT_DEDUPLICATION = get_bool_from_environment(
+    "LBOT_ENABLE_SHARED_EVENT_DEDUPLICATION")
+
+# LINE APIの(接続, 読み込み)のタイムアウト(秒)
+API_TIMEOUT = (get_number_from_environment("LBOT_LINE_API_CONNECT_TIMEOUT", float, 3.05, 1),
+               get_number_from_environment("LBOT_LINE_API_READ_TIMEOUT", float, 10, 1))
+# LINE APIへのリクエストが一時的なエラーで失敗した場合の再試行の最大回数
+API_MAX_RETRY_COUNT = get_number_from_environment(
+    "LBOT_LINE_API_MAX_RETRY_COUNT", int, MAX_RETRY_COUNT)
+
+api = linebot.LineBotApi(ACCESS_TOKEN, timeout=API_TIMEOUT,
+                         http_client=partial(PooledRetryingHttpClient, max_retry_count=API_MAX_RETRY_COUNT))
@@ -1,32 +1,96 @@
 '''LINE関連のUtility関数群'''
 
-from ..authorities import UserAuthority
+import linebot
+
+from ..authorities import USER_AUTHORITY_CODE_MAP, UserAuthority
+from ..caches import SingleFlight, TTLCache
 from ..exceptions import GroupNotFoundError, UserNotFoundError
 from ..models import Group, LineGroup, LineUser, User
+from . import identity_cache
 from .line_settings import api as line_api
 
+# キャッシュしておくLINEのプロフィールの最大数
+PROFILE_CACHE_SIZE = 1000
+# LINEのプロフィールのキャッシュ期間(秒)
+PROFILE_CACHE_TTL = 60 * 60
+# LINEのプロフィールの取得に失敗した場合に再取得しない期間(秒)。利用条件に合意していないユーザーなど
+PROFILE_NEGATIVE_CACHE_TTL = 10 * 60
+# LINEのプロフィールの取得でサーバーエラーが起きた場合に再取得しない期間(秒)
+PROFILE_SERVER_ERROR_CACHE_TTL = 30
+
+# (LINEグループID, LINEユーザーID) -> プロフィールか取得失敗時の(ステータスコード, エラー)
+__profile_cache = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+__profile_loader = SingleFlight()
+
 
 def get_user_by_line_user_id_from_database(line_user_id: str)->User:
-    '''LINEのユーザーIDでデータベースからユーザーを取得する。ない場合は作成する'''
+    '''LINEのユーザーIDでデータベースからユーザーを取得する。主キーがキャッシュにある場合は主キーで読み込む'''
+    user_id = identity_cache.get_user_id(line_user_id)
+    if user_id is not None:
+        user = User.objects.filter(id=user_id).first()
+        if user:
+            return user
     try:
-        return User.objects.get(line_user__user_id__exact=line_user_id)
+        user = User.objects.get(line_user__user_id__exact=line_user_id)
+        identity_cache.set_user_id(line_user_id, user.id)
+        return user
     except User.DoesNotExist:
         raise UserNotFoundError(
             "ユーザー(LineUserID: {})が見つかりませんでした。".format(line_user_id))
 
 
 def get_group_by_line_group_id_from_database(line_group_id: str)->Group:
-    '''LINEのグループIDでデータベースからグループを取得する'''
+    '''LINEのグループIDでデータベースからグループを取得する。主キーがキャッシュにある場合は主キーで読み込む'''
+    group_id = identity_cache.get_group_id(line_group_id)
+    if group_id is not None:
+        group = Group.objects.filter(id=group_id).first()
+        if group:
+            return group
     try:
-        return Group.objects.get(line_group__group_id__exact=line_group_id)
+        group = Group.objects.get(line_group__group_id__exact=line_group_id)
+        identity_cache.set_group_id(line_group_id, group.id)
+        return group
     except Group.DoesNotExist:
         raise GroupNotFoundError(
             "グループ(LineGroupID: {})が見つかりませんでした。".format(line_group_id))
 
 
+def get_line_profile(line_user_id: str, line_group_id: str = None):
+    '''LINEからユーザーのプロフィールを取得する。グループIDを指定した場合はグループメンバーのプロフィールを取得する。
+    結果はキャッシュし、同じユーザーの同時取得は一回のAPI呼び出しにまとめる。
+    取得に失敗した場合はLineBotApiErrorを送出し、失敗もしばらくの間キャッシュする。'''
+    key = (line_group_id, line_user_id)
+    profile = __profile_cache.get(key)
+    if profile is None:
+        profile = __profile_loader.do(
+            key, lambda: __fetch_line_profile(line_user_id, line_group_id))
+    if isinstance(profile, tuple):
+        status_code, error = profile
+        raise linebot.exceptions.LineBotApiError(status_code, error)
+    return profile
+
+
+def __fetch_line_profile(line_user_id: str, line_group_id: str):
+    '''LINEからプロフィールを取得してキャッシュする。失敗した場合は(ステータスコード, エラー)をキャッシュして返す'''
+    key = (line_group_id, line_user_id)
+    try:
+        if line_group_id:
+            profile = line_api.get_group_member_profile(
+                line_group_id, line_user_id)
+        else:
+            profile = line_api.get_profile(line_user_id)
+    except linebot.exceptions.LineBotApiError as error:
+        failure = (error.status_code, error.error)
+        __profile_cache.set(key, failure, PROFILE_SERVER_ERROR_CACHE_TTL if error.status_code >=
+                            500 else PROFILE_NEGATIVE_CACHE_TTL)
+        return failure
+    __profile_cache.set(key, profile)
+    return profile
+
+
 def register_user_by_line_user_id(line_user_id: str)->User:
     '''LINEユーザーIDでユーザーを登録する。戻り値は新しいユーザーデータ'''
-    user_profile = line_api.get_profile(line_user_id)
+    user_profile = get_line_profile(line_user_id)
     name = user_profile.display_name
     # LINEユーザーをデータベースに登録
     new_line_user = LineUser.objects.create(user_id=line_user_id, name=name)
@@ -39,7 +103,7 @@ def register_user_by_line_user_id(line_user_id: str)->User:
             name_candidate = name + str(counter)
             counter += 1
         new_user = User.objects.create(name=name_candidate, line_user=new_line_user,
-                                       authority=UserAuthority.Watcher.name)
+                                       authority=USER_AUTHORITY_CODE_MAP[UserAuthority.Watcher])
         print("ユーザー(LineID: {}, Name: {})をデータベースに登録しました。".format(line_user_id, name))
         return new_user
     except Exception:
@@ -54,8 +118,7 @@ def register_user_by_line_user_id_in_group(line_user_id: str, line_group_id: str
     new_user = None
     new_line_user = None
     try:
-        user_profile = line_api.get_group_member_profile(
-            line_group_id, line_user_id)
+        user_profile = get_line_profile(line_user_id, line_group_id)
         name = user_profile.display_name
         # LINEユーザーをデータベースに登録
         new_line_user = LineUser.objects.create(
@@ -68,11 +131,11 @@ def register_user_by_line_user_id_in_group(line_user_id: str, line_group_id: str
             name_candidate = name + str(counter)
             counter += 1
         new_user = User.objects.create(name=name_candidate, line_user=new_line_user,
-                                       authority=UserAuthority.Watcher.name)
+                                       authority=USER_AUTHORITY_CODE_MAP[UserAuthority.Watcher])
         # グループにユーザーを登録
         group = get_group_by_line_group_id_from_database(line_group_id)
+        # メンバーの追加は即座に保存されるので、グループ全体は保存し直さない
         group.members.add(new_user)
-        group.save()
         print("ユーザー(LineID: {}, Name: {})をデータベースに登録しました。".format(line_user_id, name))
         return new_user
     except Exception:
@@ -106,10 +169,30 @@ def register_group_by_line_group_id(line_group_id: str)->Group:
 def add_member_to_group_if_need(user: User, group: Group)->bool:
     '''ユーザーがグループに属している確認して、属していないなら登録する。
         戻り値は追加されたかどうか。'''
+    if identity_cache.is_group_member(group.id, user.id):
+        return False
     if not group.members.filter(id=user.id).exists():
         print("ユーザー「{}」をグループ「{}」に登録。".format(user.name, group.name))
         group.members.add(user)
-        group.save()
         return True
     else:
+        identity_cache.set_group_member(group.id, user.id)
         return False
+
+
+def get_event_source_key(event)->str:
+    '''イベントの送信元を表すキーを取得する'''
+    source = event.source
+    if source is None:
+        return None
+    if source.type == "group":
+        return "group:{}".format(source.group_id)
+    elif source.type == "room":
+        return "room:{}".format(source.room_id)
+    else:
+        return "user:{}".format(source.user_id)
+
+
+def is_known_group_member(line_group_id: str, line_user_id: str)->bool:
+    '''LINEユーザーがLINEグループのメンバーとして登録済みであることを最近確認したかどうか。データベースは参照しない'''
+    return identity_cache.is_known_group_member(line_group_id, line_user_id)
@@ -0,0 +1,58 @@
+'''送信メッセージのまとめ'''
+
+import sys
+from collections import OrderedDict
+
+# 一回のプッシュ又は返信で送信できるメッセージの最大数
+MAX_MESSAGE_COUNT_PER_REQUEST = 5
+
+
+def split_messages_into_requests(messages: list)->[list]:
+    '''メッセージのリストを一回のAPI呼び出しで送信できる数ずつに分ける'''
+    return [messages[idx:idx + MAX_MESSAGE_COUNT_PER_REQUEST] for idx in range(0, len(messages), MAX_MESSAGE_COUNT_PER_REQUEST)]
+
+
+class PushMessageBuilder(object):
+    '''宛先ごとにメッセージを集め、できるだけ少ないAPI呼び出しでプッシュ送信できるようにまとめるクラス。
+    まとめたメッセージは送信待ちキュー(outbox.enqueue_push_messages)を通して送信し、同じ宛先へのメッセージは追加した順に送信される。'''
+
+    def __init__(self):
+        self.__destination_messages_map = OrderedDict()
+
+    def add(self, to: str, message):
+        '''送信するメッセージを追加する'''
+        self.__destination_messages_map.setdefault(to, []).append(message)
+
+    def build(self)->[(str, list)]:
+        '''(宛先, 一回で送信するメッセージリスト)のリストを作成する'''
+        return [(to, request_messages) for to, messages in self.__destination_messages_map.items()
+                for request_messages in split_messages_into_requests(messages)]
+
+    def clear(self):
+        '''集めたメッセージを破棄する'''
+        self.__destination_messages_map.clear()
+
+
+class ReplyMessageBuilder(object):
+    '''一つのイベントへの返信メッセージを集め、一回の返信で送信するクラス。
+    返信トークンは一度しか使えないので、送信できる最大数を超えたメッセージは送信されない。'''
+
+    def __init__(self, reply_token: str):
+        self.reply_token = reply_token
+        self.__messages = []
+
+    def add(self, message):
+        '''返信するメッセージを追加する'''
+        self.__messages.append(message)
+
+    def send(self, api):
+        '''集めたメッセージがあれば返信して空にする'''
+        messages = self.__messages
+        self.__messages = []
+        if not messages:
+            return
+        if len(messages) > MAX_MESSAGE_COUNT_PER_REQUEST:
+            sys.stderr.write("返信メッセージが{}件を超えたので、{}件のメッセージを送信しませんでした。\n".format(
+                MAX_MESSAGE_COUNT_PER_REQUEST, len(messages) - MAX_MESSAGE_COUNT_PER_REQUEST))
+        api.reply_message(
+            self.reply_token, messages[:MAX_MESSAGE_COUNT_PER_REQUEST])
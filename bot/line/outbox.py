@@ -0,0 +1,213 @@
+'''プッシュメッセージの送信待ちキュー(アウトボックス)。
+送信内容をデータベースの更新と同じトランザクションで記録しておき、後からディスパッチャーで送信する。'''
+
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import linebot
+from django.db import close_old_connections
+from django.db.models import F
+
+from ..models import OutboxMessage
+from . import line_settings
+from .line_http_client import use_retry_key
+from .outbound_messages import PushMessageBuilder
+
+# 送信中として確保する期間。ディスパッチャーが途中で落ちた場合はこれを過ぎると再送される
+LOCK_DURATION = timedelta(minutes=5)
+# 送信の最大試行回数。これを超えたメッセージは破棄する
+MAX_ATTEMPT_COUNT = 8
+# 再送までの待ち時間の基準。試行ごとに倍になる
+RETRY_BACKOFF_BASE = timedelta(seconds=30)
+# 再送までの最大待ち時間
+RETRY_BACKOFF_MAX = timedelta(hours=1)
+# 一回のディスパッチで確認する送信待ちメッセージの数
+DISPATCH_BATCH_SIZE = 500
+# 宛先ごとの送信の最大並列数。増やしすぎるとデータベースの接続数上限にひっかかる
+MAX_WORKER_COUNT = 4
+# 一秒あたりの最大送信回数。LINEのAPIのレート制限より十分小さくする
+MAX_SEND_COUNT_PER_SECOND = 50
+# 送信メッセージのタイプとクラスの対応
+MESSAGE_TYPE_CLASS_MAP = {
+    "text": linebot.models.TextSendMessage,
+}
+
+
+class RateLimiter(object):
+    '''一秒あたりの実行回数を制限するスレッドセーフなクラス'''
+
+    def __init__(self, count_per_second: float):
+        self.interval = 1 / count_per_second
+        self.__next_time = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def wait(self):
+        '''実行できるまで待つ'''
+        with self.__lock:
+            now = time.monotonic()
+            wait_seconds = self.__next_time - now
+            self.__next_time = max(self.__next_time, now) + self.interval
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+
+__executor = ThreadPoolExecutor(MAX_WORKER_COUNT)
+__rate_limiter = RateLimiter(MAX_SEND_COUNT_PER_SECOND)
+
+
+def enqueue_push_messages(message_builder: PushMessageBuilder):
+    '''集めたメッセージを送信待ちとして記録して空にする。
+    呼び出し元のトランザクション内で記録されるので、データベースの更新と同時に確定する'''
+    now = datetime.now(timezone.utc)
+    OutboxMessage.objects.bulk_create([
+        OutboxMessage(destination=to, messages=json.dumps([message.as_json_dict() for message in messages], ensure_ascii=False),
+                      idempotency_key=str(uuid.uuid4()), next_attempt_at=now)
+        for to, messages in message_builder.build()])
+    message_builder.clear()
+
+
+def load_messages(outbox_message: OutboxMessage)->list:
+    '''記録された送信メッセージを復元する'''
+    return [MESSAGE_TYPE_CLASS_MAP[message["type"]].new_from_json_dict(message)
+            for message in json.loads(outbox_message.messages)]
+
+
+def get_retry_delay(attempt_count: int)->timedelta:
+    '''再送までの待ち時間を取得する'''
+    delay = min(RETRY_BACKOFF_BASE * 2 ** (attempt_count - 1),
+                RETRY_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1)
+
+
+def claim_outbox_message(outbox_message_id: int, destination: str, now: datetime)->bool:
+    '''送信待ちメッセージを送信中として確保する。他のディスパッチャーに先に確保されていたらFalse。
+    順番を守るため、同じ宛先にそれより古いメッセージ(送信中のものを含む)が残っている場合も確保しない'''
+    return bool(OutboxMessage.objects.filter(id=outbox_message_id, next_attempt_at__lte=now).exclude(
+        destination__in=OutboxMessage.objects.filter(destination=destination, id__lt=outbox_message_id).values("destination")).update(
+        next_attempt_at=now + LOCK_DURATION, attempt_count=F("attempt_count") + 1))
+
+
+def is_permanent_error(error: linebot.exceptions.LineBotApiError)->bool:
+    '''再送しても成功しないエラーかどうか'''
+    return 400 <= error.status_code < 500 and error.status_code != 429
+
+
+def send_outbox_message(outbox_message: OutboxMessage, api)->bool:
+    '''確保した送信待ちメッセージを送信する。戻り値は送信が完了した(又は破棄した)かどうか'''
+    __rate_limiter.wait()
+    try:
+        # 送信をやり直しても二重に送信されないように、記録時に決めた冪等キーを再試行キーとして用いる
+        with use_retry_key(outbox_message.idempotency_key):
+            api.push_message(outbox_message.destination,
+                             load_messages(outbox_message))
+    except linebot.exceptions.LineBotApiError as error:
+        # 前回の試行で受け付けられていた場合は409が返ってくる
+        if error.status_code == 409:
+            return True
+        if is_permanent_error(error):
+            sys.stderr.write("送信待ちメッセージ(ID: {}, 宛先: {})の送信に失敗したので破棄します。({})\n".format(
+                outbox_message.id, outbox_message.destination, error))
+            return True
+        error_str = str(error)
+    except Exception:
+        error_str = str(sys.exc_info()[1])
+    else:
+        return True
+
+    if outbox_message.attempt_count >= MAX_ATTEMPT_COUNT:
+        sys.stderr.write("送信待ちメッセージ(ID: {}, 宛先: {})の送信が{}回失敗したので破棄します。({})\n".format(
+            outbox_message.id, outbox_message.destination, MAX_ATTEMPT_COUNT, error_str))
+        return True
+    sys.stderr.write("送信待ちメッセージ(ID: {}, 宛先: {})の送信に失敗しました。後で再送します。({}/{})({})\n".format(
+        outbox_message.id, outbox_message.destination, outbox_message.attempt_count, MAX_ATTEMPT_COUNT, error_str))
+    return False
+
+
+def postpone_destination(outbox_message: OutboxMessage):
+    '''送信に失敗したメッセージの再送を予定する。
+    同じ宛先への後のメッセージが先に届かないように、それらも同じ時刻まで送信を遅らせる'''
+    next_attempt_at = datetime.now(timezone.utc) + \
+        get_retry_delay(outbox_message.attempt_count)
+    OutboxMessage.objects.filter(id=outbox_message.id).update(
+        next_attempt_at=next_attempt_at)
+    OutboxMessage.objects.filter(destination=outbox_message.destination, id__gt=outbox_message.id,
+                                 next_attempt_at__lt=next_attempt_at).update(next_attempt_at=next_attempt_at)
+
+
+def dispatch_destination_messages(destination: str, outbox_message_ids: [int], api, now: datetime)->int:
+    '''同じ宛先の送信待ちメッセージを順番に送信する。戻り値は送信を完了したメッセージの数'''
+    sent_count = 0
+    for outbox_message_id in outbox_message_ids:
+        # 確保できなかったら、順番を守るためこの宛先の残りは確保しているディスパッチャーか次回に任せる
+        if not claim_outbox_message(outbox_message_id, destination, now):
+            break
+        outbox_message = OutboxMessage.objects.get(id=outbox_message_id)
+        if send_outbox_message(outbox_message, api):
+            outbox_message.delete()
+            sent_count += 1
+        else:
+            # 順番を守るため、この宛先の残りのメッセージは再送時に送信する
+            postpone_destination(outbox_message)
+            break
+    return sent_count
+
+
+def dispatch_destination_messages_in_worker(destination: str, outbox_message_ids: [int], api, now: datetime)->int:
+    '''ワーカースレッドで同じ宛先の送信待ちメッセージを送信する'''
+    # ワーカースレッドはディスパッチをまたいで使い回されるので、データベース接続を自分で管理する
+    close_old_connections()
+    try:
+        return dispatch_destination_messages(destination, outbox_message_ids, api, now)
+    finally:
+        close_old_connections()
+
+
+def dispatch_outbox_messages(api=None, parallel: bool=True, destination_prefix: str=None)->int:
+    '''送信時刻になった送信待ちメッセージを送信する。戻り値は送信を完了したメッセージの数。
+    宛先が異なるメッセージは並列に、同じ宛先のメッセージは古いものから順番に送信する。
+    ある宛先への送信でエラーが発生しても、他の宛先への送信は続ける。
+    宛先の接頭辞を指定した場合は、宛先がそれで始まるメッセージのみ送信する'''
+    if api is None:
+        api = line_settings.api
+    now = datetime.now(timezone.utc)
+    outbox_message_set = OutboxMessage.objects.filter(next_attempt_at__lte=now)
+    if destination_prefix is not None:
+        outbox_message_set = outbox_message_set.filter(
+            destination__startswith=destination_prefix)
+    # 宛先ごとに古い順でまとめる
+    destination_ids_map = OrderedDict()
+    for outbox_message_id, destination in outbox_message_set.order_by(
+            "id").values_list("id", "destination")[:DISPATCH_BATCH_SIZE]:
+        destination_ids_map.setdefault(destination, []).append(outbox_message_id)
+
+    # 宛先が一つだけか並列にしない場合は呼び出し元のスレッドでそのまま送信する
+    if not parallel or len(destination_ids_map) <= 1:
+        sent_count = 0
+        for destination, outbox_message_ids in destination_ids_map.items():
+            try:
+                sent_count += dispatch_destination_messages(
+                    destination, outbox_message_ids, api, now)
+            except Exception:
+                sys.stderr.write("宛先({})への送信待ちメッセージの送信でエラーが発生しました。({})\n".format(
+                    destination, sys.exc_info()[1]))
+        return sent_count
+
+    destination_future_map = OrderedDict(
+        (destination, __executor.submit(dispatch_destination_messages_in_worker, destination, outbox_message_ids, api, now))
+        for destination, outbox_message_ids in destination_ids_map.items())
+    sent_count = 0
+    for destination, future in destination_future_map.items():
+        error = future.exception()
+        if error is None:
+            sent_count += future.result()
+        else:
+            sys.stderr.write("宛先({})への送信待ちメッセージの送信でエラーが発生しました。({})\n".format(
+                destination, error))
+    return sent_count
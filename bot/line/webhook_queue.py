@@ -0,0 +1,120 @@
+'''Webhookの非同期処理キュー。
+送信元が同じWebhookは、複数のワーカーやプロセスで処理する場合も受信順に一つずつ処理する'''
+
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+
+from django.db import close_old_connections
+from django.db.models import F, Q
+
+from ..models import WebhookQueueItem
+from . import event_handlers
+from .line_utilities import get_event_source_key
+
+# 1プロセスあたりのワーカースレッド数。増やしすぎるとデータベースの接続数上限にひっかかる
+WORKER_COUNT = 2
+# 一度に確保を試みるアイテムの候補数。送信元の順番待ちのアイテムを飛ばして他の送信元のアイテムを確保できるようにする
+CLAIM_CANDIDATE_COUNT = 20
+# キューが空の時にキューを確認し直す間隔(秒)。追加時は即座にワーカーが起こされる
+POLLING_INTERVAL = 30
+# ワーカーがアイテムを処理中として確保する期間。ワーカーが途中で落ちた場合はこれを過ぎると再処理される。
+# 再処理で処理中のイベントを引き継げるように、event_deduplication.EVENT_PROCESSING_LOCK_DURATIONより長くする
+LOCK_DURATION = timedelta(minutes=5)
+# 処理の最大試行回数。これを超えたアイテムは破棄する
+MAX_ATTEMPT_COUNT = 3
+
+__wakeup_event = threading.Event()
+__worker_start_lock = threading.Lock()
+__worker_threads = []
+
+
+def get_webhook_source_key(events: list)->str:
+    '''Webhookのイベントの送信元を表すキーを取得する。送信元が複数ある場合はNone'''
+    source_key_set = {get_event_source_key(event) for event in events}
+    return source_key_set.pop() if len(source_key_set) == 1 else None
+
+
+def enqueue(body: str, signature: str):
+    '''署名を検証してからWebhookをキューに追加し、ワーカーを起こす'''
+    # 署名が不正ならInvalidSignatureErrorが送出される
+    events = event_handlers.event_handler.parser.parse(body, signature)
+    WebhookQueueItem.objects.create(
+        body=body, signature=signature, source_key=get_webhook_source_key(events))
+    start_workers_if_need()
+    __wakeup_event.set()
+
+
+def has_earlier_item(item_id: int, source_key: str)->bool:
+    '''同じ送信元の、より古いアイテム(処理中のものを含む)が残っているかどうか。
+    送信元が複数のアイテムは全ての送信元と順番を守る'''
+    earlier_item_set = WebhookQueueItem.objects.filter(id__lt=item_id)
+    if source_key is not None:
+        earlier_item_set = earlier_item_set.filter(
+            Q(source_key=source_key) | Q(source_key__isnull=True))
+    return earlier_item_set.exists()
+
+
+def claim_next_item()->WebhookQueueItem:
+    '''処理されていない最も古いアイテムを確保して返す。なければNone。
+    受信順を守るため、同じ送信元のより古いアイテムが残っているアイテムは確保しない'''
+    now = datetime.now(timezone.utc)
+    claimable = Q(locked_until__isnull=True) | Q(locked_until__lte=now)
+    candidates = WebhookQueueItem.objects.filter(
+        claimable).order_by("id").values_list("id", "source_key")[:CLAIM_CANDIDATE_COUNT]
+    for candidate_id, source_key in candidates:
+        # 古いアイテムは消えるだけなので、確認してから確保するまでの間に順番が崩れることはない
+        if has_earlier_item(candidate_id, source_key):
+            continue
+        # 他のワーカーに先に確保されていたら次の候補を試す
+        if WebhookQueueItem.objects.filter(claimable, id=candidate_id).update(
+                locked_until=now + LOCK_DURATION, attempt_count=F("attempt_count") + 1):
+            return WebhookQueueItem.objects.get(id=candidate_id)
+    return None
+
+
+def process_item(item: WebhookQueueItem):
+    '''アイテムのWebhookを処理する。
+    ハンドラでの例外は返信済みなので再試行はしない。再試行はワーカーが途中で落ちた場合のみ行う'''
+    if item.attempt_count > MAX_ATTEMPT_COUNT:
+        sys.stderr.write("Webhook(ID: {})の処理が{}回失敗したので破棄します。\n".format(
+            item.id, MAX_ATTEMPT_COUNT))
+        item.delete()
+        return
+    try:
+        event_handlers.event_handler.handle(item.body, item.signature)
+    except Exception:
+        sys.stderr.write("Webhook(ID: {})の処理でエラーが発生しました。({})\n".format(
+            item.id, sys.exc_info()[1]))
+    item.delete()
+
+
+def run_worker():
+    '''キューを処理し続ける'''
+    while True:
+        # スレッドごとのデータベース接続が古くなっていたら閉じる
+        close_old_connections()
+        __wakeup_event.clear()
+        try:
+            item = claim_next_item()
+        except Exception:
+            sys.stderr.write("Webhookキューの取得でエラーが発生しました。({})\n".format(
+                sys.exc_info()[1]))
+            item = None
+        if item:
+            process_item(item)
+            # 処理したアイテムの順番待ちをしていたアイテムを他のワーカーが確保できるようにする
+            __wakeup_event.set()
+        else:
+            __wakeup_event.wait(POLLING_INTERVAL)
+
+
+def start_workers_if_need():
+    '''このプロセスのワーカースレッドが起動していなければ起動する'''
+    with __worker_start_lock:
+        if __worker_threads:
+            return
+        for _ in range(WORKER_COUNT):
+            worker_thread = threading.Thread(target=run_worker, daemon=True)
+            worker_thread.start()
+            __worker_threads.append(worker_thread)
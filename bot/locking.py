@@ -0,0 +1,100 @@
+'''複数のプロセスやサーバーの間での排他制御'''
+
+import os
+import socket
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Q
+
+from .models import Lease
+
+# リースの期間。保持者が落ちた場合はこれを過ぎると他のプロセスが取得できる
+LEASE_DURATION = timedelta(seconds=60)
+# リースを延長する間隔。リースの期間より十分短くする
+LEASE_HEARTBEAT_INTERVAL = timedelta(seconds=20)
+
+
+def create_lease_owner()->str:
+    '''リースの保持者を識別する文字列を作成する'''
+    return "{}:{}:{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+def try_acquire_lease(name: str, owner: str, duration: timedelta=LEASE_DURATION)->bool:
+    '''リースの取得を試みる。他の保持者のリースが期限内なら取得できない'''
+    now = datetime.now(timezone.utc)
+    try:
+        with transaction.atomic():
+            Lease.objects.create(name=name, owner=owner,
+                                 expires_at=now + duration)
+        return True
+    except IntegrityError:
+        pass
+    # 期限切れか自分のリースなら取得する
+    return bool(Lease.objects.filter(Q(expires_at__lte=now) | Q(owner=owner), name=name).update(
+        owner=owner, expires_at=now + duration))
+
+
+def renew_lease(name: str, owner: str, duration: timedelta=LEASE_DURATION)->bool:
+    '''保持しているリースを延長する。他の保持者に取られていたらFalse'''
+    return bool(Lease.objects.filter(name=name, owner=owner).update(
+        expires_at=datetime.now(timezone.utc) + duration))
+
+
+def release_lease(name: str, owner: str):
+    '''保持しているリースを解放する'''
+    Lease.objects.filter(name=name, owner=owner).delete()
+
+
+def __run_lease_heartbeat(name: str, owner: str, duration: timedelta, stop_event: threading.Event):
+    '''停止されるまでリースを延長し続ける'''
+    try:
+        while not stop_event.wait(LEASE_HEARTBEAT_INTERVAL.total_seconds()):
+            close_old_connections()
+            try:
+                if not renew_lease(name, owner, duration):
+                    sys.stderr.write("リース「{}」が他の保持者に取得されました。\n".format(name))
+                    return
+            except Exception:
+                sys.stderr.write("リース「{}」の延長でエラーが発生しました。({})\n".format(
+                    name, sys.exc_info()[1]))
+    finally:
+        # スレッドごとのデータベース接続を閉じる
+        connection.close()
+
+
+@contextmanager
+def hold_lease(name: str, duration: timedelta=LEASE_DURATION):
+    '''リースの取得を試み、取得できたら抜けるまでハートビートで延長しながら保持する。
+    取得できたかどうかを返す'''
+    owner = create_lease_owner()
+    if not try_acquire_lease(name, owner, duration):
+        yield False
+        return
+    stop_event = threading.Event()
+    heartbeat_thread = threading.Thread(target=__run_lease_heartbeat, args=(
+        name, owner, duration, stop_event), daemon=True)
+    heartbeat_thread.start()
+    try:
+        yield True
+    finally:
+        stop_event.set()
+        heartbeat_thread.join()
+        release_lease(name, owner)
+
+
+def select_for_update_skip_locked(queryset):
+    '''他のトランザクションがロックしている行を飛ばして、取得する行をロックするクエリセットを返す。
+    複数のワーカーが同じ条件で取得しても、重ならない行を取得できる。トランザクション内で用いる。
+    SKIP LOCKEDに対応していないデータベース(SQLiteなど)ではそのまま返す。SQLiteでは書き込みがデータベース全体で直列化される'''
+    if not connection.features.has_select_for_update_skip_locked:
+        return queryset
+    options = {"skip_locked": True}
+    # 関連テーブルの行はロックしない
+    if connection.features.has_select_for_update_of:
+        options["of"] = ("self",)
+    return queryset.select_for_update(**options)
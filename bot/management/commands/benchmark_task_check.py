@@ -0,0 +1,47 @@
+'''benchmark_task_checkコマンド'''
+
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from ...simulation import SyntheticDataShard, create_synthetic_dataset
+from ...task_check import TaskChecker, TaskCheckType
+from ...utilities import TIMEZONE_DEFAULT
+
+
+class Command(BaseCommand):
+    '''benchmark_task_checkコマンド'''
+    # python manage.py help benchmark_task_checkで表示されるメッセージ
+    help = 'グループあたりのタスク数を変えながら合成データでタスク確認を実行し、クエリ数と実行時間を表示する。既存のデータは確認しない。データベースへの変更は全て取り消される。'
+
+    def add_arguments(self, parser):
+        '''コマンドライン引数を指定。
+        argparseモジュールが渡される。'''
+        parser.add_argument('--group-count', dest="group_count",
+                            type=int, default=10)
+        parser.add_argument('--members-per-group', dest="members_per_group",
+                            type=int, default=5)
+        parser.add_argument('--tasks-per-group', dest="tasks_per_group_list",
+                            type=int, nargs="+", default=[1, 4, 16, 64])
+
+    def handle(self, *args, **options):
+        group_count = options["group_count"]
+        print("グループ数: {}, グループあたりのメンバー数: {}".format(
+            group_count, options["members_per_group"]))
+        print("タスク数\tクエリ数\t実行時間(秒)")
+        for tasks_per_group in options["tasks_per_group_list"]:
+            with transaction.atomic():
+                create_synthetic_dataset(
+                    group_count, tasks_per_group, options["members_per_group"], datetime.now(TIMEZONE_DEFAULT))
+                with CaptureQueriesContext(connection) as queries:
+                    start_time = time.perf_counter()
+                    TaskChecker.execute(
+                        TaskCheckType.All, True, SyntheticDataShard())
+                    elapsed_time = time.perf_counter() - start_time
+                print("{}\t{}\t{:.3f}".format(
+                    group_count * tasks_per_group, len(queries), elapsed_time))
+                # 計測で作成・変更したデータは残さない
+                transaction.set_rollback(True)
@@ -1,8 +1,11 @@
 '''check_tasksコマンド'''
 
+import time
+
 from django.core.management.base import BaseCommand
 
-from ...task_check import TaskChecker, TaskCheckType
+from ...line.outbox import dispatch_outbox_messages
+from ...task_check import TaskChecker, TaskCheckShard, TaskCheckType
 
 
 class Command(BaseCommand):
@@ -17,8 +20,21 @@ class Command(BaseCommand):
                             type=TaskCheckType, choices=list(TaskCheckType))
         parser.add_argument('-f', dest="force",
                             action="store_true", default=False)
+        parser.add_argument('--shard', dest="shard", type=TaskCheckShard.parse, default=None,
+                            help='"インデックス/シャード数"(例: 0/4)。グループのIDをシャード数で割った余りがインデックスと一致するグループのタスクのみ確認する')
 
     def handle(self, *args, **options):
         task_check_type = options["task_check_type"]
         force = options["force"] if "force" in options else False
-        TaskChecker.execute(task_check_type, force)
+        shard = options.get("shard")
+        start_time = time.perf_counter()
+        report = TaskChecker.execute(task_check_type, force, shard)
+        # 確認で記録されたメッセージを送信する
+        sent_count = dispatch_outbox_messages()
+        # シャードを増やすべきか判断できるように、確認の種類ごとの対象タスク数と実行時間を表示する
+        shard_str = str(shard) if shard else "全体"
+        for checked_type, task_count, elapsed_time in report:
+            print("シャード{} {}: {}({:.3f}秒)".format(shard_str, checked_type.value,
+                                                  "{}件".format(task_count) if task_count is not None else "他のプロセスが実行中", elapsed_time))
+        print("シャード{} 合計: タスク{}件, 送信{}件({:.3f}秒)".format(shard_str, sum(
+            task_count for _, task_count, _ in report if task_count), sent_count, time.perf_counter() - start_time))
@@ -0,0 +1,18 @@
+'''dispatch_outboxコマンド'''
+
+from django.core.management.base import BaseCommand
+
+from ...line.outbox import dispatch_outbox_messages
+
+
+class Command(BaseCommand):
+    '''dispatch_outboxコマンド'''
+    # python manage.py help dispatch_outboxで表示されるメッセージ
+    help = '送信時刻になった送信待ちのプッシュメッセージを送信する'
+
+    def add_arguments(self, parser):
+        pass
+
+    def handle(self, *args, **options):
+        sent_count = dispatch_outbox_messages()
+        print("送信待ちメッセージ{}件を送信しました。".format(sent_count))
@@ -0,0 +1,19 @@
+'''process_webhook_queueコマンド'''
+
+from django.core.management.base import BaseCommand
+
+from ...line import webhook_queue
+
+
+class Command(BaseCommand):
+    '''process_webhook_queueコマンド'''
+    # python manage.py help process_webhook_queueで表示されるメッセージ
+    help = 'キューに積まれたWebhookを処理し続ける。Webサーバーとは別のプロセスでWebhookを処理する場合に用いる。'
+
+    def add_arguments(self, parser):
+        pass
+
+    def handle(self, *args, **options):
+        webhook_queue.start_workers_if_need()
+        # ワーカーはデーモンスレッドなので、メインスレッドもワーカーとして動かし続ける
+        webhook_queue.run_worker()
@@ -2,8 +2,7 @@
 
 from django.core.management.base import BaseCommand
 
-from ...message_commands import remove_message_command_group
-from ...models import Group, Task, TaskJoinCheckJob, User
+from ...models import MessageCommandGroupActivation, Task, TaskJoinCheckJob
 
 
 class Command(BaseCommand):
@@ -21,7 +20,5 @@ class Command(BaseCommand):
         # タスク確認ジョブの削除
         TaskJoinCheckJob.objects.all().delete()
         # タスク参加確認コマンドを無効化
-        for user in User.objects.all():
-            remove_message_command_group(user, "タスク参加確認")
-        for group in Group.objects.all():
-            remove_message_command_group(group, "タスク参加確認")
+        MessageCommandGroupActivation.objects.filter(
+            command_group_name="タスク参加確認").delete()
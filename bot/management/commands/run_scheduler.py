@@ -0,0 +1,28 @@
+'''run_schedulerコマンド'''
+
+from apscheduler.schedulers.blocking import BlockingScheduler
+from django.core.management.base import BaseCommand
+
+from ... import task_scheduler
+
+# 他のプロセスでのタスクの変更を反映するために、次の確認日時を計算し直す間隔(分)
+RESCHEDULE_INTERVAL = 1
+
+
+class Command(BaseCommand):
+    '''run_schedulerコマンド'''
+    # python manage.py help run_schedulerで表示されるメッセージ
+    help = 'タスク確認などの定期ジョブを実行し続ける。Webサーバーとは別のプロセスで定期ジョブを実行する場合に用いる。'
+
+    def add_arguments(self, parser):
+        pass
+
+    def handle(self, *args, **options):
+        scheduler = task_scheduler.create_scheduler(BlockingScheduler)
+        # タスクの変更はWebサーバーのプロセスで行われ、このプロセスには通知されないので定期的に計算し直す
+        scheduler.add_job(task_scheduler.rearm, "interval",
+                          minutes=RESCHEDULE_INTERVAL, coalesce=True, misfire_grace_time=None)
+        try:
+            scheduler.start()
+        except (KeyboardInterrupt, SystemExit):
+            pass
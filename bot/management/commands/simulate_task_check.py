@@ -0,0 +1,165 @@
+'''simulate_task_checkコマンド'''
+
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+
+from ...clock import VirtualClock, use_clock
+from ...line.outbox import dispatch_outbox_messages
+from ...models import Task, TaskJoinCheckJob
+from ...simulation import (SYNTHETIC_NAME_PREFIX, RecordingLineBotApi,
+                           SyntheticDataShard, create_synthetic_dataset)
+from ...task_check import (SOON_REMIND_AND_CHECK_BEFORE, TOMORROW_CHECK_TIME,
+                           TOMORROW_REMIND_TIME, TaskChecker, TaskCheckType)
+from ...task_scheduler import (MIN_CHECK_INTERVAL, get_day_before_at,
+                               get_next_check_datetime)
+from ...utilities import TIMEZONE_DEFAULT
+
+# シミュレーションする確認の種類。TaskCheckType.Allと同じ順番で実行する
+SIMULATED_TASK_CHECK_TYPE_LIST = [
+    TaskCheckType.ProcessOverDueTask,
+    TaskCheckType.TommorowTasksRemind,
+    TaskCheckType.TommorowImportantTasksCheck,
+    TaskCheckType.SoonTasksRemindAndCheck,
+]
+
+
+class TaskCheckStatistics(object):
+    '''確認の種類ごとの集計'''
+
+    def __init__(self):
+        self.execution_count = 0
+        self.task_count = 0
+        self.query_count = 0
+        self.push_count = 0
+        self.elapsed_time = 0
+        self.lateness_list = []
+
+
+def load_task_state_map()->{int: tuple}:
+    '''合成タスク(ID)ごとの(期限, 明日のリマインド済み, 明日の確認済み, もうすぐの確認済み, 参加確認中)を取得する'''
+    synthetic_task_set = Task.objects.filter(
+        name__startswith="{}-task-".format(SYNTHETIC_NAME_PREFIX))
+    checking_task_id_set = set(TaskJoinCheckJob.objects.filter(
+        task__in=synthetic_task_set).values_list("task_id", flat=True))
+    return {task_id: (deadline, is_tomorrow_remind_finished, is_tomorrow_check_finished, is_soon_check_finished, task_id in checking_task_id_set)
+            for task_id, deadline, is_tomorrow_remind_finished, is_tomorrow_check_finished, is_soon_check_finished in synthetic_task_set.values_list(
+                "id", "deadline", "is_tomorrow_remind_finished", "is_tomorrow_check_finished", "is_soon_check_finished")}
+
+
+def get_processed_deadline_list(task_check_type: TaskCheckType, before_state_map: {int: tuple}, after_state_map: {int: tuple})->[datetime]:
+    '''確認の前後の状態を比べて、確認で処理されたタスクの期限のリストを取得する'''
+    if task_check_type == TaskCheckType.ProcessOverDueTask:
+        # 参加確認が終了したタスク
+        return [state[0] for task_id, state in before_state_map.items() if state[4] and not after_state_map[task_id][4]]
+    state_idx = {
+        TaskCheckType.TommorowTasksRemind: 1,
+        TaskCheckType.TommorowImportantTasksCheck: 2,
+        TaskCheckType.SoonTasksRemindAndCheck: 3,
+    }[task_check_type]
+    # 終了フラグが立ったタスク
+    return [state[0] for task_id, state in before_state_map.items() if not state[state_idx] and after_state_map[task_id][state_idx]]
+
+
+def get_due_datetime(task_check_type: TaskCheckType, deadline: datetime)->datetime:
+    '''タスクを確認すべきだった日時を取得する'''
+    if task_check_type == TaskCheckType.TommorowTasksRemind:
+        return get_day_before_at(deadline, TOMORROW_REMIND_TIME)
+    if task_check_type == TaskCheckType.TommorowImportantTasksCheck:
+        return get_day_before_at(deadline, TOMORROW_CHECK_TIME)
+    if task_check_type == TaskCheckType.SoonTasksRemindAndCheck:
+        return deadline - SOON_REMIND_AND_CHECK_BEFORE
+    return deadline
+
+
+class Command(BaseCommand):
+    '''simulate_task_checkコマンド'''
+    # python manage.py help simulate_task_checkで表示されるメッセージ
+    help = '仮想時計で合成データに対するタスク確認を指定日数分再現し、確認の種類ごとのクエリ数、送信数、実行時間、遅れを表示する。既存のデータは確認しない。データベースへの変更は全て取り消される。'
+
+    def add_arguments(self, parser):
+        '''コマンドライン引数を指定。
+        argparseモジュールが渡される。'''
+        parser.add_argument('--group-count', dest="group_count",
+                            type=int, default=10)
+        parser.add_argument('--members-per-group', dest="members_per_group",
+                            type=int, default=5)
+        parser.add_argument('--tasks-per-group', dest="tasks_per_group",
+                            type=int, default=16)
+        parser.add_argument('--days', dest="days",
+                            type=int, default=7)
+        # 指定した場合はスケジューラの代わりに一定間隔(分)で確認する
+        parser.add_argument('--interval', dest="interval",
+                            type=int, default=None)
+
+    def handle(self, *args, **options):
+        clock = VirtualClock(datetime.now(TIMEZONE_DEFAULT))
+        start_datetime = clock.now()
+        end_datetime = start_datetime + timedelta(days=options["days"])
+        api = RecordingLineBotApi()
+        statistics_map = OrderedDict((task_check_type, TaskCheckStatistics())
+                                     for task_check_type in SIMULATED_TASK_CHECK_TYPE_LIST)
+        step_count = 0
+        start_time = time.perf_counter()
+        shard = SyntheticDataShard()
+        with use_clock(clock), transaction.atomic():
+            create_synthetic_dataset(options["group_count"], options["tasks_per_group"], options["members_per_group"],
+                                     start_datetime, end_datetime - start_datetime)
+            while clock.now() <= end_datetime:
+                step_count += 1
+                for task_check_type in SIMULATED_TASK_CHECK_TYPE_LIST:
+                    self.__simulate_task_check(
+                        task_check_type, statistics_map[task_check_type], api, clock, start_datetime, shard)
+                # 次の確認日時まで時計を進める
+                if options["interval"]:
+                    clock.advance(timedelta(minutes=options["interval"]))
+                else:
+                    clock.advance_to(max(get_next_check_datetime(
+                        clock.now(), shard), clock.now() + MIN_CHECK_INTERVAL))
+            # シミュレーションで作成・変更したデータは残さない
+            transaction.set_rollback(True)
+        elapsed_time = time.perf_counter() - start_time
+
+        print("グループ数: {}, グループあたりのメンバー数: {}, グループあたりのタスク数: {}".format(
+            options["group_count"], options["members_per_group"], options["tasks_per_group"]))
+        print("期間: {} - {}, 確認回数: {}, 全体の実行時間: {:.3f}秒".format(
+            start_datetime, end_datetime, step_count, elapsed_time))
+        print("確認の種類\t実行回数\tタスク数\tクエリ数\t送信数\t実行時間(秒)\t平均の遅れ(分)\t最大の遅れ(分)")
+        for task_check_type, statistics in statistics_map.items():
+            lateness_list = statistics.lateness_list or [timedelta()]
+            print("{}\t{}\t{}\t{}\t{}\t{:.3f}\t{:.1f}\t{:.1f}".format(
+                task_check_type.value, statistics.execution_count, statistics.task_count, statistics.query_count,
+                statistics.push_count, statistics.elapsed_time,
+                sum(lateness_list, timedelta()).total_seconds() / 60 / len(lateness_list),
+                max(lateness_list).total_seconds() / 60))
+
+    @staticmethod
+    def __simulate_task_check(task_check_type, statistics, api, clock, start_datetime, shard):
+        '''確認を一つ実行して送信待ちメッセージを偽のAPIに送信し、集計する'''
+        before_state_map = load_task_state_map()
+        # 記録できるクエリ数には上限があるので、確認ごとに記録を空にする
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            task_check_start_time = time.perf_counter()
+            ((_, task_count, _),) = TaskChecker.execute(
+                task_check_type, shard=shard)
+            statistics.elapsed_time += time.perf_counter() - task_check_start_time
+        statistics.query_count += len(queries)
+        after_state_map = load_task_state_map()
+        push_count = len(api.pushed_message_list)
+        dispatch_outbox_messages(
+            api, parallel=False, destination_prefix="{}-line-group-".format(SYNTHETIC_NAME_PREFIX))
+        statistics.push_count += len(api.pushed_message_list) - push_count
+
+        if task_count:
+            statistics.execution_count += 1
+            statistics.task_count += task_count
+            for deadline in get_processed_deadline_list(task_check_type, before_state_map, after_state_map):
+                # シミュレーション開始前に確認すべきだったものは開始時を基準にする
+                due_datetime = max(get_due_datetime(
+                    task_check_type, deadline), start_datetime)
+                statistics.lateness_list.append(clock.now() - due_datetime)
@@ -1,3 +1,3 @@
 '''check_task_message_commandsパッケージ初期化'''
 
-from .check_task_command import CheckTaskMessageCommandGroup, disable_task_check_command_if_need
+from .check_task_command import CheckTaskMessageCommandGroup, disable_task_check_command_if_need, disable_task_check_command_of_groups_if_need
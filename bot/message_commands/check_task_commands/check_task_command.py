@@ -3,7 +3,7 @@
 import sys
 
 from ...authorities import UserAuthority
-from ...models import TaskJoinCheckJob, User
+from ...models import MessageCommandGroupActivation, TaskJoinCheckJob, User
 from ...utilities import split_command_paramater_strig
 from ..message_command import (CommandSource, MessageCommandGroupBase,
                                remove_message_command_group)
@@ -28,6 +28,12 @@ def disable_task_check_command_if_need(command_source: CommandSource):
         remove_message_command_group(command_source.user_data, "タスク参加確認")
 
 
+def disable_task_check_command_of_groups_if_need(group_id_list: [int]):
+    '''指定したグループのうち、確認中のタスクがなくなったグループのタスク確認コマンドをまとめて無効にする'''
+    MessageCommandGroupActivation.objects.filter(group__in=group_id_list, command_group_name="タスク参加確認").exclude(
+        group__in=TaskJoinCheckJob.objects.filter(group__in=group_id_list).values("group")).delete()
+
+
 def set_user_participate_state(user: User, task_check_job: TaskJoinCheckJob, is_participate: bool):
     '''ユーザーのタスク参加状態を設定する'''
     task = task_check_job.task
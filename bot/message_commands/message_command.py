@@ -4,13 +4,18 @@ import difflib
 import inspect
 import sys
 import unicodedata
+from collections import Counter
 
-from ..authorities import UserAuthority
-from ..models import Group, User
+from django.db import IntegrityError, transaction
+
+from ..authorities import CODE_USER_AUTHORITY_MAP, UserAuthority
+from ..caches import LRUCache
+from ..models import Group, MessageCommandGroupActivation, User
 from ..reply_generators import generate_random_reply
-from ..utilities import (add_to_comma_separeted_string,
-                         remove_from_comma_separeted_string,
-                         split_command_paramater_strig)
+
+
+# コマンドグループごとに覚えておく、最近の提案の検索結果の数
+COMMAND_SUGGESTION_CACHE_SIZE = 1024
 
 
 class CommandSource(object):
@@ -19,6 +24,8 @@ class CommandSource(object):
     def __init__(self, user_data: User, group_data: Group):
         self.user_data = user_data
         self.group_data = group_data
+        # 解決済みのコマンドの振り分け。同じ送信元で有効なコマンドグループを何度も問い合わせないようにする
+        self.command_dispatch = None
 
 
 def normalize_command_string(command_string):
@@ -27,6 +34,83 @@ def normalize_command_string(command_string):
     return command_string
 
 
+def get_command_arity(command_func)->(int, int):
+    '''コマンドハンドラが受け取るコマンドパラメータの(最小数, 最大数)を取得する。最大数に制限がない場合はNone'''
+    # 第一引数はコマンド送信元
+    parameter_list = list(inspect.signature(
+        command_func).parameters.values())[1:]
+    positional_parameter_list = [parameter for parameter in parameter_list if parameter.kind in (
+        inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD)]
+    min_count = len([parameter for parameter in positional_parameter_list
+                     if parameter.default is inspect.Parameter.empty])
+    if any(parameter.kind == inspect.Parameter.VAR_POSITIONAL for parameter in parameter_list):
+        return min_count, None
+    return min_count, len(positional_parameter_list)
+
+
+class CommandInfo(object):
+    '''登録されたコマンドのハンドラと、登録時に求めておく引数の数や使い方'''
+
+    def __init__(self, command_group_name: str, name: str, func, authority: UserAuthority):
+        self.name = name
+        self.func = func
+        self.authority = authority
+        self.min_param_count, self.max_param_count = get_command_arity(func)
+        self.doc = inspect.getdoc(func)
+        # 使い方コマンドで表示する詳細説明
+        self.usage = "<{}コマンド「{}」の使い方>\n■必要権限\n{}\n■説明\n{}".format(
+            command_group_name, name, authority.name, self.doc)
+        # 引数の数が不正な場合の返信
+        self.invalid_param_count_reply = "コマンド引数の数が不正です。\n■「{}」コマンドの使い方\n{}".format(
+            name, self.doc)
+
+    def is_valid_param_count(self, param_count: int)->bool:
+        '''コマンドパラメータの数が正しいかどうか'''
+        return self.min_param_count <= param_count and (self.max_param_count is None or param_count <= self.max_param_count)
+
+
+class CommandSuggestionIndex(object):
+    '''コマンド名の文字の転置索引を用いて、似ているコマンド名を探すクラス。
+    共通する文字数から求めたdifflib.SequenceMatcherの一致率の上限が閾値に届かないコマンド名は、一致率を計算せずに除く。
+    最近の検索結果はキャッシュする。'''
+
+    def __init__(self, command_name_list: [str], threshold: float):
+        self.threshold = threshold
+        self.__command_name_list = list(command_name_list)
+        # 文字ごとの(コマンド名のインデックス, コマンド名に含まれる数)のリスト
+        self.__char_index = {}
+        for command_idx, command_name in enumerate(self.__command_name_list):
+            for char, count in Counter(command_name).items():
+                self.__char_index.setdefault(
+                    char, []).append((command_idx, count))
+        self.__cache = LRUCache(COMMAND_SUGGESTION_CACHE_SIZE)
+
+    def find(self, command: str)->[str]:
+        '''一致率が閾値以上のコマンド名のリストを登録順に取得する'''
+        command_suggestions = self.__cache.get(command)
+        if command_suggestions is None:
+            command_suggestions = self.__find(command)
+            self.__cache.set(command, command_suggestions)
+        return command_suggestions
+
+    def __find(self, command: str)->[str]:
+        '''キャッシュを使わずに似ているコマンド名を探す'''
+        # コマンド名ごとに共通する文字数を数える
+        common_count_map = Counter()
+        for char, count in Counter(command).items():
+            for command_idx, command_count in self.__char_index.get(char, []):
+                common_count_map[command_idx] += min(count, command_count)
+        # 一致率は共通する文字数の二倍を両方の文字数の和で割ったもの以下になる
+        command_suggestions = []
+        for command_idx in range(len(self.__command_name_list)):
+            command_name = self.__command_name_list[command_idx]
+            if 2.0 * common_count_map[command_idx] / (len(command) + len(command_name)) < self.threshold:
+                continue
+            if difflib.SequenceMatcher(None, command, command_name).ratio() >= self.threshold:
+                command_suggestions.append(command_name)
+        return command_suggestions
+
+
 class MessageCommandGroupBase(object):
     '''メッセージコマンドグループの基底クラス
     コマンドグループはこれを継承し、クラス変数として"name"と"order"を定義すること。'''
@@ -49,73 +133,79 @@ class MessageCommandGroupBase(object):
         第一引数にコマンド送信元、第二引数以降にコマンドパラメータを取り、(返信,エラーリスト)を戻り値とする関数を登録する。
         返信がNoneの場合はコマンド失敗とみなす。'''
         def decorator(func):
-            # __command_map変数を持っていなかったら追加する
-            cls.command_map()[command_name] = (func, authority)
+            # 引数の数や使い方は実行のたびに求めないように、ここで求めておく
+            cls.command_map()[command_name] = CommandInfo(
+                cls.name, command_name, func, authority)
+            return func
         return decorator
 
     @classmethod
     def command_map(cls):
-        '''コマンドマップを取得する'''
+        '''コマンド名からコマンド情報へのコマンドマップを取得する'''
         # 基底クラスに固有のコマンドマップを使用するためにここで手動で作成する
         if not hasattr(cls, "impl_command_map"):
             setattr(cls, "impl_command_map", {})
         return cls.impl_command_map
 
+    def build_command_suggestion_index(self):
+        '''コマンドの提案に用いる索引を作成する。コマンドの追加後に呼ぶこと'''
+        self.__suggestion_index = CommandSuggestionIndex(
+            self.__class__.command_map().keys(), self.suggestion_word_match_rate_threshold)
+
+    def find_command_suggestions(self, command: str)->[str]:
+        '''コマンドの提案が有効なら、指定コマンドに似ているコマンド名のリストを取得する'''
+        if not self.enable_command_suggestion:
+            return []
+        return self.__suggestion_index.find(command)
+
     def execute_command(self, command_name: str, command_source: CommandSource, command_param_list: [str])->(bool, str):
         '''コマンドを実行する。
         戻り値は(続けるかどうか,返信メッセージ)。'''
         command = normalize_command_string(command_name)
         command_map = self.__class__.command_map()
 
-        # 指定コマンドがコマンドマップにない場合
+        # 指定コマンドがコマンドマップにない場合は、設定に応じて提案したりする
         if command not in command_map:
-            # コマンド文字列がから出ない場合は、設定に応じて提案したりする
-            if command is not None:
-                # コマンドの提案
-                if self.enable_command_suggestion:
-                    command_suggestions = [command_name for command_name in command_map.keys(
-                    ) if difflib.SequenceMatcher(None, command, command_name).ratio() >= self.suggestion_word_match_rate_threshold]
-                    if len(command_suggestions) == 1:
-                        # コマンドの自動保管が有効なら提案コマンドをコマンドとする
-                        if self.enable_auto_command_correction:
-                            command = command_suggestions[0]
-                        # そうでない場合は提案を返信する
-                        else:
-                            return False, "{}？もしかして{}の間違いかなぁ？".format(command, "「" + command_suggestions[0] + "」")
-                    elif command_suggestions:
-                        return False, "{}？もしかして{}のどれかの間違いかなぁ？".format(command, "、".join(["「" + command_sug + "」" for command_sug in command_suggestions]))
-                    else:
-                        return True, None
+            command_suggestions = self.find_command_suggestions(command)
+            if len(command_suggestions) == 1:
+                # コマンドの自動保管が有効なら提案コマンドをコマンドとする
+                if self.enable_auto_command_correction:
+                    command = command_suggestions[0]
+                # そうでない場合は提案を返信する
                 else:
-                    return True, None
-            # 空の場合はコマンド実行しない
+                    return False, "{}？もしかして{}の間違いかなぁ？".format(command, "「" + command_suggestions[0] + "」")
+            elif command_suggestions:
+                return False, "{}？もしかして{}のどれかの間違いかなぁ？".format(command, "、".join(["「" + command_sug + "」" for command_sug in command_suggestions]))
             else:
                 return True, None
 
-        command_func, command_authority = command_map[command]
-        # 権限の確認
-        user_authority = UserAuthority[command_source.user_data.authority]
-        if not user_authority.check(command_authority):
-            return False, "残念ながら権限がないよ。Youの権限：{}、コマンドの要求権限：{}。権限の変更はMasterユーザーに頼んでネ^_^".format(
-                user_authority.name, command_authority.name)
-
-        # コマンドの実行
-        try:
-            inspect.signature(command_func).bind(
-                command_source, *command_param_list)
-        except TypeError:
-            sys.stderr.write(
-                "コマンドの実行でエラーが発生。({})\n".format(sys.exc_info()[1]))
-            return False, "コマンド引数の数が不正です。\n■「{}」コマンドの使い方\n{}".format(command, inspect.getdoc(command_func))
-        reply, errors = command_func(
-            command_source, *command_param_list)
-
-        # 結果を返す
-        if reply is None:
-            errors.append("コマンド「{}」の実行に失敗しちゃった。。。".format(command))
-        else:
-            errors.append(reply)
-        return False, "\n".join(errors)
+        return False, run_command(command_map[command], command_source, command_param_list)
+
+
+def run_command(command_info: CommandInfo, command_source: CommandSource, command_param_list: [str])->str:
+    '''権限と引数の数を確認してコマンドハンドラを実行する。戻り値は返信メッセージ'''
+    # 権限の確認
+    user_authority = CODE_USER_AUTHORITY_MAP[command_source.user_data.authority]
+    if not user_authority.check(command_info.authority):
+        return "残念ながら権限がないよ。Youの権限：{}、コマンドの要求権限：{}。権限の変更はMasterユーザーに頼んでネ^_^".format(
+            user_authority.name, command_info.authority.name)
+
+    # 引数の数の確認
+    if not command_info.is_valid_param_count(len(command_param_list)):
+        sys.stderr.write("コマンドの実行でエラーが発生。(「{}」コマンドの引数の数が不正です。{}個)\n".format(
+            command_info.name, len(command_param_list)))
+        return command_info.invalid_param_count_reply
+
+    # コマンドの実行
+    reply, errors = command_info.func(
+        command_source, *command_param_list)
+
+    # 結果を返す
+    if reply is None:
+        errors.append("コマンド「{}」の実行に失敗しちゃった。。。".format(command_info.name))
+    else:
+        errors.append(reply)
+    return "\n".join(errors)
 
 
 class SystemMessageCommand(MessageCommandGroupBase):
@@ -130,19 +220,67 @@ class SystemMessageCommand(MessageCommandGroupBase):
 
 __command_group_order_map = {}
 __command_group_list = {}
+# 有効なコマンドグループ名の集合ごとのコマンドの振り分け
+__command_dispatch_map = {}
+# 使い方コマンドでコマンド一覧の前に表示する説明
+HELP_COMMAND_DESCRIPTION = 'グループの場合は「#」を先頭に付けて、個人ラインの場合は何も付けずに、コマンドを指定して実行することができます。\n' + \
+    'コマンドでない文字列を指定した場合はてきとうな返事を返します。' + \
+    'また、「使い方」コマンドにコマンド名を指定することでそのコマンドの詳細説明を表示します。\n'
+
+
+class CommandDispatch(object):
+    '''有効なコマンドグループの組み合わせごとに作成する、コマンドの振り分けと使い方の表示'''
+
+    def __init__(self, valid_command_group_list: [MessageCommandGroupBase]):
+        # 順番に並んだ有効なコマンドグループリスト
+        self.valid_command_group_list = valid_command_group_list
+        # コマンド名から(コマンドグループ, コマンド情報)への振り分け表。同じ名前のコマンドは先に実行されるコマンドグループのものを用いる
+        self.command_dispatch_table = {}
+        for command_group in valid_command_group_list:
+            for command_name, command_info in command_group.command_map().items():
+                self.command_dispatch_table.setdefault(
+                    command_name, (command_group, command_info))
+        # コマンド一覧の文字列
+        self.command_list_string = '<コマンド一覧>'
+        for command_group in valid_command_group_list:
+            command_list = ["■{}(権限：{})".format(command_name, command_info.authority.name)
+                            for command_name, command_info in command_group.command_map().items()]
+            self.command_list_string += "\n--{}コマンド--\n".format(
+                command_group.name)
+            self.command_list_string += "\n".join(command_list)
+        # 使い方コマンドの返信
+        self.help_reply = HELP_COMMAND_DESCRIPTION + self.command_list_string
+
+
+def compile_command_dispatch(valid_command_group_name_set: frozenset)->CommandDispatch:
+    '''有効なコマンドグループを順番に並べてコマンドの振り分けを作成する'''
+    # 定義かデータベースで有効指定されているなら有効とする
+    return CommandDispatch([command_group for order, (is_valid, command_group) in sorted(__command_group_list.items(), key=lambda order_group: order_group[0])
+                            if is_valid or command_group.name in valid_command_group_name_set])
+
+
+def get_command_dispatch(command_source: CommandSource)->CommandDispatch:
+    '''送信元で有効なコマンドの振り分けを取得する。
+    有効なコマンドグループの組み合わせごとに一度だけ作成し、送信元ごとに一度だけデータベースに問い合わせる'''
+    if command_source.command_dispatch is not None:
+        return command_source.command_dispatch
+    # 送信元がグループの場合はそのグループの、個人の場合はそのユーザーの有効コマンドグループを取得
+    target = command_source.group_data or command_source.user_data
+    # 登録されていないグループ名は無視して、組み合わせの数が増えないようにする
+    valid_command_group_name_set = frozenset(command_group_name for command_group_name in get_valid_message_command_group_names(
+        target) if command_group_name in __command_group_order_map)
+    command_dispatch = __command_dispatch_map.get(valid_command_group_name_set)
+    if command_dispatch is None:
+        command_dispatch = compile_command_dispatch(
+            valid_command_group_name_set)
+        __command_dispatch_map[valid_command_group_name_set] = command_dispatch
+    command_source.command_dispatch = command_dispatch
+    return command_dispatch
 
 
 def get_ordered_valid_command_group_list(command_source: CommandSource):
     '''順番に並んだ有効なコマンドグループリストを取得する'''
-    # 送信元がグループの場合はそのグループの、個人の場合はそのユーザーの有効コマンドグループを取得
-    if command_source.group_data:
-        valid_message_command_groups = command_source.group_data.valid_message_command_groups
-    else:
-        valid_message_command_groups = command_source.user_data.valid_message_command_groups
-    valid_message_command_group_list = split_command_paramater_strig(
-        valid_message_command_groups)
-    # 定義かデータベースで有効指定されているなら有効とする
-    return [command_group for order, (is_valid, command_group) in sorted(__command_group_list.items(), key=lambda order_group: order_group[0]) if is_valid or command_group.name in valid_message_command_group_list]
+    return get_command_dispatch(command_source).valid_command_group_list
 
 
 @SystemMessageCommand.add_command("使い方", UserAuthority.Watcher)
@@ -150,62 +288,67 @@ def help_command(command_source: CommandSource, target_command_name: str = None)
     '''使い方を表示します。コマンドの指定がない場合はコマンドの一覧を表示します。
     ■コマンド引数
     (1: 使い方を見たいコマンド名)'''
-    # コマンドグループを優先度準に並び替える
-    valid_command_group_list = get_ordered_valid_command_group_list(
-        command_source)
-
-    def generate_command_list_string():
-        '''コマンドリスト文字列を生成'''
-        result = '<コマンド一覧>'
-        for command_group in valid_command_group_list:
-            command_list = ["■{}(権限：{})".format(command_name, command_authority.name)
-                            for command_name, (command_func, command_authority) in command_group.command_map().items()]
-            result += "\n--{}コマンド--\n".format(command_group.name)
-            result += "\n".join(command_list)
-        return result
+    # 有効なコマンドグループの組み合わせごとに作成済みの表示を用いる。コマンドの実行時に解決済みなので問い合わせない
+    command_dispatch = get_command_dispatch(command_source)
 
     # ターゲットが指定されていたらそのコマンドの詳細を表示
     if target_command_name:
-        reply = None
         # コマンドグループの先頭から検索し、最初にヒットしたものを選ぶ
-        for command_group in valid_command_group_list:
-            if target_command_name in command_group.command_map():
-                command_func, command_authority = command_group.command_map()[
-                    target_command_name]
-                reply = "<{}コマンド「{}」の使い方>\n■必要権限\n{}\n■説明\n{}".format(
-                    command_group.name, target_command_name, command_authority.name, inspect.getdoc(command_func))
-        if reply:
-            return reply, []
+        if target_command_name in command_dispatch.command_dispatch_table:
+            command_group, command_info = command_dispatch.command_dispatch_table[
+                target_command_name]
+            return command_info.usage, []
         else:
-            return None, ["「{}」コマンドは存在しません。\n{}".format(target_command_name, generate_command_list_string())]
+            return None, ["「{}」コマンドは存在しません。\n{}".format(target_command_name, command_dispatch.command_list_string)]
 
     # 指定されていなかったらコマンドリストを表示
     else:
-        reply = 'グループの場合は「#」を先頭に付けて、個人ラインの場合は何も付けずに、コマンドを指定して実行することができます。\n'
-        reply += 'コマンドでない文字列を指定した場合はてきとうな返事を返します。'
-        reply += 'また、「使い方」コマンドにコマンド名を指定することでそのコマンドの詳細説明を表示します。\n'
-        reply += generate_command_list_string()
-        return reply, []
+        return command_dispatch.help_reply, []
 
 
-def add_message_command_group(target, group_name, auto_save=True):
-    '''ユーザーかグループにメッセージコマンドグループを追加する'''
-    if not isinstance(target, User) and not isinstance(target, Group):
-        return TypeError("GroupかUserのみ対応しています。")
-    target.valid_message_command_groups = add_to_comma_separeted_string(
-        target.valid_message_command_groups, group_name)
-    if auto_save:
-        target.save()
+def get_activation_filter(target)->dict:
+    '''ユーザーかグループで有効にしたメッセージコマンドグループを絞り込む条件を取得する'''
+    if isinstance(target, User):
+        return {"user": target}
+    if isinstance(target, Group):
+        return {"group": target}
+    raise TypeError("GroupかUserのみ対応しています。")
 
 
-def remove_message_command_group(target, group_name, auto_save=True):
+def get_valid_message_command_group_names(target)->[str]:
+    '''ユーザーかグループで有効にしたメッセージコマンドグループ名のリストを取得する'''
+    return list(MessageCommandGroupActivation.objects.filter(**get_activation_filter(target)).values_list("command_group_name", flat=True))
+
+
+def add_message_command_group(target, group_name):
+    '''ユーザーかグループにメッセージコマンドグループを追加する'''
+    MessageCommandGroupActivation.objects.get_or_create(
+        command_group_name=group_name, **get_activation_filter(target))
+
+
+def add_message_command_group_to_groups(group_list: [Group], group_name):
+    '''複数のグループにメッセージコマンドグループをまとめて追加する。既に追加済みのグループは除く。
+    呼び出し元のトランザクションを中断しないように、同時に追加されて重複した場合は一つずつ追加し直す'''
+    activated_group_id_set = set(MessageCommandGroupActivation.objects.filter(
+        group__in=group_list, command_group_name=group_name).values_list("group_id", flat=True))
+    new_group_list = [group for group in {group.id: group for group in group_list}.values()
+                      if group.id not in activated_group_id_set]
+    if not new_group_list:
+        return
+    try:
+        # 重複した場合はこのセーブポイントまで戻す
+        with transaction.atomic():
+            MessageCommandGroupActivation.objects.bulk_create([MessageCommandGroupActivation(group=group, command_group_name=group_name)
+                                                               for group in new_group_list])
+    except IntegrityError:
+        for group in new_group_list:
+            add_message_command_group(group, group_name)
+
+
+def remove_message_command_group(target, group_name):
     '''ユーザーかグループからメッセージコマンドグループを削除する'''
-    if not isinstance(target, User) and not isinstance(target, Group):
-        return TypeError("GroupかUserのみ対応しています。")
-    target.valid_message_command_groups = remove_from_comma_separeted_string(
-        target.valid_message_command_groups, group_name)
-    if auto_save:
-        target.save()
+    MessageCommandGroupActivation.objects.filter(
+        command_group_name=group_name, **get_activation_filter(target)).delete()
 
 
 def register_command_groups():
@@ -215,18 +358,27 @@ def register_command_groups():
         command_group_order = command_group_class.order
         command_group_name = command_group_class.name
         __command_group_order_map[command_group_name] = command_group_order
+        command_group = command_group_class()
+        command_group.build_command_suggestion_index()
         __command_group_list[command_group_order] = (
-            command_group_class.validate_in_initialize, command_group_class())
+            command_group_class.validate_in_initialize, command_group)
+    # 登録前に作成した振り分け表は使わない
+    __command_dispatch_map.clear()
 
 
 def execute_message_command(command_name: str, command_source: CommandSource,  command_param_list: [str]):
     '''コマンドを実行する。戻り値は返信メッセージ。'''
-    # コマンドグループを優先度準に並び替える
-    valid_command_group_list = get_ordered_valid_command_group_list(
-        command_source)
+    command_dispatch = get_command_dispatch(command_source)
+
+    # 一致するコマンドがあれば振り分け表から直接実行する
+    command = normalize_command_string(command_name)
+    if command in command_dispatch.command_dispatch_table:
+        command_group, command_info = command_dispatch.command_dispatch_table[
+            command]
+        return run_command(command_info, command_source, command_param_list)
 
-    for command_group in valid_command_group_list:
-        # コマンド実行
+    # 一致するコマンドがなければ、優先度順に各コマンドグループで提案などを行う
+    for command_group in command_dispatch.valid_command_group_list:
         is_continue, reply = command_group.execute_command(
             command_name, command_source, command_param_list)
         # 続行しないなら最後の返信を返す
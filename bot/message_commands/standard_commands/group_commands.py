@@ -1,7 +1,7 @@
 '''グループ関連のメッセージコマンド'''
 
 from ... import database_utilities as db_util
-from ...authorities import UserAuthority
+from ...authorities import CODE_USER_AUTHORITY_MAP, UserAuthority
 from ...exceptions import GroupNotFoundError
 from ...models import Group, User
 from ..message_command import CommandSource
@@ -11,7 +11,7 @@ from .standard_command import StandardMessageCommandGroup
 def check_group_edit_authority(user: User, group: Group):
     '''ユーザーにグループの編集権限があるかどうか。
     Masterユーザーかグループ管理者ならあるとみなす。'''
-    return UserAuthority[user.authority] == UserAuthority.Master or group.managers.filter(id__exact=user.id).exists()
+    return CODE_USER_AUTHORITY_MAP[user.authority] == UserAuthority.Master or group.managers.filter(id__exact=user.id).exists()
 
 
 def check_group_watch_authority(user: User, group: Group):
@@ -82,7 +82,7 @@ def change_group_name_command(command_source: CommandSource, new_group_name: str
         else:
             old_group_name = group.name
             group.name = new_group_name
-            group.save()
+            group.save(update_fields=["name"])
             return "グループ「{}」の名前を「{}」に変更しました。".format(old_group_name, new_group_name), []
     else:
         return None, ["グループ「{}」の変更権限がない！　グループの変更はMasterユーザーか管理者にしかできないっ！".format(group.name)]
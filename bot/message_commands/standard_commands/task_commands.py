@@ -6,10 +6,11 @@ from dateutil.parser import parse as datetime_parse
 
 from ... import database_utilities as db_util
 from ... import utilities as util
-from ...authorities import UserAuthority
+from ...authorities import CODE_USER_AUTHORITY_MAP, UserAuthority
 from ...exceptions import (GroupNotFoundError, TaskNotFoundError,
                            UserNotFoundError)
-from ...models import Task, TaskImportance, User
+from ...models import (CODE_TASK_IMPORTANCE_MAP, TASK_IMPORTANCE_CODE_MAP,
+                       Task, TaskImportance, User)
 from ...utilities import TIMEZONE_DEFAULT
 from ..check_task_commands import disable_task_check_command_if_need
 from ..message_command import CommandSource
@@ -21,7 +22,7 @@ EVERYONE_WORD = "全員"
 def check_task_edit_authority(user: User, task: Task):
     '''ユーザーにタスクの編集権限があるかどうか。
     Masterユーザーかタスク管理者ならあるとみなす。'''
-    return UserAuthority[user.authority] == UserAuthority.Master or task.managers.filter(id__exact=user.id).exists()
+    return CODE_USER_AUTHORITY_MAP[user.authority] == UserAuthority.Master or task.managers.filter(id__exact=user.id).exists()
 
 
 def check_task_watch_authority(user: User, task: Task):
@@ -77,7 +78,7 @@ def add_task_command(command_source: CommandSource, task_name: str, dead_line: s
         return None, ["無効な重要度が指定された……。重要度は「高」、「中」、「低」のいずれかだよ……。"]
 
     new_task = Task.objects.create(
-        name=task_name, deadline=task_deadline, importance=task_importance.name)
+        name=task_name, deadline=task_deadline, importance=TASK_IMPORTANCE_CODE_MAP[task_importance])
     new_task.managers.add(task_create_user)
     try:
         # 参加グループ設定
@@ -241,7 +242,7 @@ def check_task_command(command_source: CommandSource, target_task_name: str)->(s
                 task.short_name if task.short_name else "未設定")
             reply += "■期限\n{}\n".format(
                 util.convert_datetime_in_default_timezone_to_string(task.deadline))
-            reply += "■重要度\n{}\n".format(TaskImportance[task.importance].value)
+            reply += "■重要度\n{}\n".format(CODE_TASK_IMPORTANCE_MAP[task.importance].value)
             # メンバー
             if task.participants.exists():
                 participants_str = ",".join(
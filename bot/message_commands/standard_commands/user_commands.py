@@ -1,7 +1,8 @@
 '''ユーザー関連のメッセージコマンド'''
 
 from ... import database_utilities as db_util
-from ...authorities import UserAuthority
+from ...authorities import (CODE_USER_AUTHORITY_MAP, USER_AUTHORITY_CODE_MAP,
+                             UserAuthority)
 from ...exceptions import UserNotFoundError
 from ...models import User
 from ..message_command import CommandSource
@@ -19,7 +20,7 @@ def change_user_name_command(command_source: CommandSource, target_user_name: st
     try:
         if command_source.user_data.name == target_user_name:
             target_user = command_source.user_data
-        elif UserAuthority[command_source.user_data.authority] == UserAuthority.Master:
+        elif CODE_USER_AUTHORITY_MAP[command_source.user_data.authority] == UserAuthority.Master:
             target_user = db_util.get_user_by_name_from_database(
                 target_user_name)
             # グループの場合は対象ユーザーがそのグループのメンバーでないなら見つからなかったものとする
@@ -30,7 +31,7 @@ def change_user_name_command(command_source: CommandSource, target_user_name: st
         if User.objects.filter(name=new_user_name).exists():
             return None, ["ユーザー名「{}」は別の人が使ってるよ".format(new_user_name)]
         target_user.name = new_user_name
-        target_user.save()
+        target_user.save(update_fields=["name"])
         return "ユーザー「{}」の名前を「{}」に変更しましたよ。".format(target_user_name, new_user_name), []
     except UserNotFoundError:
         return None, ["ユーザー「{}」が見つからないよ".format(target_user_name)]
@@ -53,11 +54,11 @@ def check_user_command(command_source: CommandSource, target_user_name: str = No
             user = command_source.user_data
             target_user_name = command_source.user_data.name
         # 権限確認(エラーメッセージの表示優先度的にここでチェックする)
-        if command_source.user_data.name != target_user_name and UserAuthority[command_source.user_data.authority] != UserAuthority.Master:
+        if command_source.user_data.name != target_user_name and CODE_USER_AUTHORITY_MAP[command_source.user_data.authority] != UserAuthority.Master:
             return None, ["ユーザ情報は本人かMasterユーザーにしか表示できないんだよね。"]
         repply = "<ユーザー情報>\n"
         repply += "■ユーザー名\n{}\n".format(user.name)
-        repply += "■権限\n{}\n".format(user.authority)
+        repply += "■権限\n{}\n".format(CODE_USER_AUTHORITY_MAP[user.authority].name)
         repply += "■LINEユーザー\n{}\n".format(
             user.line_user.name if user.line_user else "なし")
         repply += "■Asanaユーザー\n{}\n".format(
@@ -120,7 +121,7 @@ def change_user_authority_command(command_source: CommandSource, target_user_nam
         if command_source.group_data and not User.objects.filter(id=user.id, belonging_groups=command_source.group_data).exists():
             raise UserNotFoundError()
         try:
-            current_authority = UserAuthority[user.authority]
+            current_authority = CODE_USER_AUTHORITY_MAP[user.authority]
             target_authority = UserAuthority[target_authority]
         except KeyError:
             return None, ["指定された権限「{}」は存在しないよ。".format(target_authority)]
@@ -129,7 +130,7 @@ def change_user_authority_command(command_source: CommandSource, target_user_nam
             return "変更は必要ないよ。", []
         # Masterユーザーの数を確認
         if current_authority == UserAuthority.Master:
-            if User.objects.filter(authority__exact=UserAuthority.Master.name).count() == 1:
+            if User.objects.filter(authority__exact=USER_AUTHORITY_CODE_MAP[UserAuthority.Master]).count() == 1:
                 return None, ["Masterユーザーがいなくなっちゃうよ。"]
         # 管理タスクとグループの確認
         if target_authority == UserAuthority.Watcher:
@@ -138,8 +139,8 @@ def change_user_authority_command(command_source: CommandSource, target_user_nam
             if user.managing_groups.exists():
                 return [None, "ユーザー「{}」には管理しているグループがあるので「{}」権限には変更できないよ。".format(target_user_name, UserAuthority.Watcher.name)]
         # 権限変更
-        user.authority = target_authority.name
-        user.save()
+        user.authority = USER_AUTHORITY_CODE_MAP[target_authority]
+        user.save(update_fields=["authority"])
         return "ユーザー「{}」の権限を「{}」から「{}」に変更したよ。".format(target_user_name, current_authority.name, target_authority.name), []
     except UserNotFoundError:
         return None, ["指定されたユーザー「{}」はいないよ。".format(target_user_name)]
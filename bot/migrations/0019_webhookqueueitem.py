@@ -0,0 +1,24 @@
+# Generated by Django 2.0 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0018_auto_20180105_2128'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookQueueItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('body', models.TextField()),
+                ('signature', models.CharField(max_length=128)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('locked_until', models.DateTimeField(null=True)),
+                ('attempt_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
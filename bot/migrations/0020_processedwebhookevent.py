@@ -0,0 +1,21 @@
+# Generated by Django 2.0 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0019_webhookqueueitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedWebhookEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=128, unique=True)),
+                ('processed_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.0 on 2026-10-18 18:11
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0021_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='taskjoincheckjob',
+            unique_together={('group', 'check_number')},
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.0 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0022_taskjoincheckjob_unique_check_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('owner', models.CharField(max_length=128)),
+                ('expires_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 2.0 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+# 移行前の名前と移行後のコードの対応
+IMPORTANCE_NAME_CODE_MAP = {'High': 0, 'Middle': 1, 'Low': 2}
+AUTHORITY_NAME_CODE_MAP = {'Master': 0, 'Editor': 1, 'Watcher': 2}
+
+
+def convert_names_to_codes(apps, schema_editor):
+    '''重要度と権限を名前からコードに変換する'''
+    Task = apps.get_model('bot', 'Task')
+    for name, code in IMPORTANCE_NAME_CODE_MAP.items():
+        Task.objects.filter(importance=name).update(importance_code=code)
+    User = apps.get_model('bot', 'User')
+    for name, code in AUTHORITY_NAME_CODE_MAP.items():
+        User.objects.filter(authority=name).update(authority_code=code)
+
+
+def convert_codes_to_names(apps, schema_editor):
+    '''重要度と権限をコードから名前に戻す'''
+    Task = apps.get_model('bot', 'Task')
+    for name, code in IMPORTANCE_NAME_CODE_MAP.items():
+        Task.objects.filter(importance_code=code).update(importance=name)
+    User = apps.get_model('bot', 'User')
+    for name, code in AUTHORITY_NAME_CODE_MAP.items():
+        User.objects.filter(authority_code=code).update(authority=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0023_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='importance_code',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='authority_code',
+            field=models.PositiveSmallIntegerField(default=2),
+        ),
+        migrations.RunPython(convert_names_to_codes, convert_codes_to_names),
+        # 巻き戻しで名前の列を追加し直せるように、既定値を設定してから削除する
+        migrations.AlterField(
+            model_name='user',
+            name='authority',
+            field=models.CharField(choices=[('Master', 'Master'), ('Editor', 'Editor'), ('Watcher', 'Watcher')], default='Watcher', max_length=16),
+        ),
+        migrations.RemoveField(
+            model_name='task',
+            name='importance',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='authority',
+        ),
+        migrations.RenameField(
+            model_name='task',
+            old_name='importance_code',
+            new_name='importance',
+        ),
+        migrations.RenameField(
+            model_name='user',
+            old_name='authority_code',
+            new_name='authority',
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='importance',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'High'), (1, 'Middle'), (2, 'Low')], default=1),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='authority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Master'), (1, 'Editor'), (2, 'Watcher')]),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['is_tomorrow_remind_finished', 'deadline'], name='task_tomorrow_remind_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['importance', 'is_tomorrow_check_finished', 'deadline'], name='task_tomorrow_check_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['importance', 'is_soon_check_finished', 'deadline'], name='task_soon_check_idx'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 2.0 on 2026-10-18 18:25
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def split_comma_separated_string(comma_separated_string):
+    '''カンマ区切り文字列を分割する'''
+    return [item for item in re.split(r"、|,", comma_separated_string) if item]
+
+
+def convert_strings_to_activations(apps, schema_editor):
+    '''カンマ区切りの有効なメッセージコマンドグループを行に変換する'''
+    MessageCommandGroupActivation = apps.get_model(
+        'bot', 'MessageCommandGroupActivation')
+    activation_list = []
+    for model_name, field_name in (('User', 'user'), ('Group', 'group')):
+        Model = apps.get_model('bot', model_name)
+        for target_id, valid_message_command_groups in Model.objects.exclude(valid_message_command_groups="").values_list('id', 'valid_message_command_groups'):
+            activation_list.extend([MessageCommandGroupActivation(command_group_name=command_group_name, **{field_name + '_id': target_id})
+                                    for command_group_name in sorted(set(split_comma_separated_string(valid_message_command_groups)))])
+    MessageCommandGroupActivation.objects.bulk_create(activation_list)
+
+
+def convert_activations_to_strings(apps, schema_editor):
+    '''有効なメッセージコマンドグループの行をカンマ区切り文字列に戻す'''
+    MessageCommandGroupActivation = apps.get_model(
+        'bot', 'MessageCommandGroupActivation')
+    for model_name, field_name in (('User', 'user'), ('Group', 'group')):
+        Model = apps.get_model('bot', model_name)
+        target_names_map = {}
+        for target_id, command_group_name in MessageCommandGroupActivation.objects.filter(**{field_name + '__isnull': False}).order_by('id').values_list(field_name + '_id', 'command_group_name'):
+            target_names_map.setdefault(target_id, []).append(command_group_name)
+        for target_id, command_group_name_list in target_names_map.items():
+            Model.objects.filter(id=target_id).update(
+                valid_message_command_groups=",".join(command_group_name_list))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0024_compact_codes_and_task_check_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageCommandGroupActivation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command_group_name', models.CharField(db_index=True, max_length=64)),
+                ('group', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='message_command_group_activations', to='bot.Group')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='message_command_group_activations', to='bot.User')),
+            ],
+            options={
+                'unique_together': {('user', 'command_group_name'), ('group', 'command_group_name')},
+            },
+        ),
+        migrations.RunPython(convert_strings_to_activations,
+                             convert_activations_to_strings),
+        migrations.RemoveField(
+            model_name='group',
+            name='valid_message_command_groups',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='valid_message_command_groups',
+        ),
+    ]
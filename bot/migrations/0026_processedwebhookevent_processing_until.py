@@ -0,0 +1,18 @@
+# Generated by Django 2.0 on 2026-10-18 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0025_messagecommandgroupactivation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processedwebhookevent',
+            name='processing_until',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0026_processedwebhookevent_processing_until'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookqueueitem',
+            name='source_key',
+            field=models.CharField(max_length=128, null=True),
+        ),
+    ]
@@ -2,7 +2,7 @@ from enum import Enum
 
 from django.db import models
 
-from bot.authorities import UserAuthority
+from bot.authorities import USER_AUTHORITY_CODE_MAP
 
 # Create your models here.
 
@@ -14,9 +14,20 @@ class TaskImportance(Enum):
     Low = "低"
 
 
-def get_choices_from_enum(source_enum):
-    '''列挙体から選択肢を取得'''
-    return [(item.name, item.name) for item in source_enum]
+# タスクの重要度とデータベースに保存するコードの対応。変更する場合は保存済みのデータを移行する必要がある
+TASK_IMPORTANCE_CODE_MAP = {
+    TaskImportance.High: 0,
+    TaskImportance.Middle: 1,
+    TaskImportance.Low: 2,
+}
+# データベースに保存するコードとタスクの重要度の対応
+CODE_TASK_IMPORTANCE_MAP = {code: importance for importance,
+                            code in TASK_IMPORTANCE_CODE_MAP.items()}
+
+
+def get_choices_from_code_map(code_map):
+    '''列挙体の要素とコードの対応からデータベースに保存するコードの選択肢を取得'''
+    return [(code, item.name) for item, code in code_map.items()]
 
 
 class Vocabulary(models.Model):
@@ -48,11 +59,9 @@ class User(models.Model):
     # Asanaのユーザー情報。そのユーザーのみ設定可能
     asana_user = models.OneToOneField(
         AsanaUser, on_delete=models.SET_NULL, null=True)
-    # 権限。Masterユーザーのみ変更可能
-    authority = models.CharField(
-        max_length=16, choices=get_choices_from_enum(UserAuthority))
-    # 有効なメッセージコマンドグループ。カンマ区切りで複数指定
-    valid_message_command_groups = models.CharField(max_length=256, default="")
+    # 権限。Masterユーザーのみ変更可能。USER_AUTHORITY_CODE_MAPのコードで保存する
+    authority = models.PositiveSmallIntegerField(
+        choices=get_choices_from_code_map(USER_AUTHORITY_CODE_MAP))
 
 
 class LineGroup(models.Model):
@@ -80,8 +89,6 @@ class Group(models.Model):
     # AsanaTeam。グループ管理者のみ変更可能
     asana_team = models.OneToOneField(
         AsanaTeam, on_delete=models.SET_NULL, null=True)
-    # 有効なメッセージコマンドグループ。カンマ区切りで複数指定
-    valid_message_command_groups = models.CharField(max_length=256, default="")
 
 
 class AsanaTask(models.Model):
@@ -97,9 +104,9 @@ class Task(models.Model):
     short_name = models.CharField(max_length=64, unique=True, null=True)
     # 締め切り。タスク作成時に設定。タスクマスターのみ変更可能
     deadline = models.DateTimeField()
-    # 重要度
-    importance = models.CharField(max_length=16, choices=get_choices_from_enum(
-        TaskImportance), default=TaskImportance.Middle.name)
+    # 重要度。TASK_IMPORTANCE_CODE_MAPのコードで保存する
+    importance = models.PositiveSmallIntegerField(choices=get_choices_from_code_map(
+        TASK_IMPORTANCE_CODE_MAP), default=TASK_IMPORTANCE_CODE_MAP[TaskImportance.Middle])
     # タスクの管理者。タスク管理者のみ変更可能
     managers = models.ManyToManyField(User, related_name="managing_tasks")
     # タスクの参加者。タスク管理者のみ変更可能
@@ -122,6 +129,20 @@ class Task(models.Model):
     # もうすぐのタスク確認が終わったかどうか(リマインド含む)
     is_soon_check_finished = models.BooleanField(default=False)
 
+    class Meta:
+        # タスク確認の種類ごとの検索条件に合わせた複合インデックス
+        indexes = [
+            # 明日のタスクのリマインド
+            models.Index(fields=["is_tomorrow_remind_finished", "deadline"],
+                         name="task_tomorrow_remind_idx"),
+            # 明日の重要タスクの確認
+            models.Index(fields=["importance", "is_tomorrow_check_finished", "deadline"],
+                         name="task_tomorrow_check_idx"),
+            # もうすぐのタスクのリマインドと確認
+            models.Index(fields=["importance", "is_soon_check_finished", "deadline"],
+                         name="task_soon_check_idx"),
+        ]
+
 
 class TaskJoinCheckJob(models.Model):
     '''タスクの参加チェックジョブデータベース'''
@@ -137,3 +158,76 @@ class TaskJoinCheckJob(models.Model):
     check_number = models.PositiveIntegerField()
     # チェックの期限
     deadline = models.DateTimeField()
+
+    class Meta:
+        # 確認番号はグループ内で一意
+        unique_together = ("group", "check_number")
+
+
+class WebhookQueueItem(models.Model):
+    '''非同期処理待ちのWebhookのキューデータベース'''
+    # リクエストボディ
+    body = models.TextField()
+    # リクエストの署名(X-Line-Signature)
+    signature = models.CharField(max_length=128)
+    # イベントの送信元を表すキー。複数の送信元のイベントを含む場合はNoneで、前後の全てのアイテムと順番を守る
+    source_key = models.CharField(max_length=128, null=True)
+    # 受信日時
+    received_at = models.DateTimeField(auto_now_add=True)
+    # ワーカーが処理中として確保している期限。未確保ならNone。期限を過ぎたら他のワーカーが再取得できる
+    locked_until = models.DateTimeField(null=True)
+    # 処理を試行した回数
+    attempt_count = models.PositiveIntegerField(default=0)
+
+
+class ProcessedWebhookEvent(models.Model):
+    '''処理済みのLINEイベントデータベース。複数プロセス間でのイベントの重複処理防止に用いる'''
+    # イベントの識別子
+    event_id = models.CharField(max_length=128, unique=True)
+    # 記録日時。処理済みの場合は処理日時
+    processed_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # 処理中の場合は、他のプロセスが処理を引き継げるようになる日時。処理済みならNone
+    processing_until = models.DateTimeField(null=True)
+
+
+class OutboxMessage(models.Model):
+    '''送信待ちのプッシュメッセージデータベース。
+    送信内容をデータベースの更新と同じトランザクションで記録しておき、後から送信する'''
+    # 宛先。LINEのユーザーID又はグループID
+    destination = models.CharField(max_length=64)
+    # 一回で送信するメッセージ。JSON形式の配列
+    messages = models.TextField()
+    # 冪等キー。LINEの再試行キーとして用い、送信をやり直しても二重に送信されないようにする
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    # 作成日時
+    created_at = models.DateTimeField(auto_now_add=True)
+    # 次に送信を試みる日時。送信中は他の送信処理に取得されないように先の日時にする
+    next_attempt_at = models.DateTimeField(db_index=True)
+    # 送信を試みた回数
+    attempt_count = models.PositiveIntegerField(default=0)
+
+
+class Lease(models.Model):
+    '''リース(期限付きの排他ロック)データベース。複数のプロセスやサーバーで同じ処理を同時に行わないようにする'''
+    # リース名。処理ごとに決める
+    name = models.CharField(max_length=64, unique=True)
+    # 保持者
+    owner = models.CharField(max_length=128)
+    # 期限。保持者はハートビートで延長し、過ぎたら他の保持者が取得できる
+    expires_at = models.DateTimeField()
+
+
+class MessageCommandGroupActivation(models.Model):
+    '''ユーザー又はグループで有効にしたメッセージコマンドグループデータベース。ユーザーとグループのどちらか一方を設定する'''
+    # 有効にしたユーザー
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True,
+                             related_name="message_command_group_activations")
+    # 有効にしたグループ
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, null=True,
+                              related_name="message_command_group_activations")
+    # メッセージコマンドグループ名
+    command_group_name = models.CharField(max_length=64, db_index=True)
+
+    class Meta:
+        unique_together = (("user", "command_group_name"),
+                           ("group", "command_group_name"))
@@ -0,0 +1,96 @@
+'''タスク確認の計測やシミュレーションに用いる合成データと偽のLINE API'''
+
+from datetime import datetime, timedelta
+
+from .authorities import USER_AUTHORITY_CODE_MAP, UserAuthority
+from .clock import get_current_datetime
+from .models import (TASK_IMPORTANCE_CODE_MAP, Group, LineGroup, Task,
+                     TaskImportance, User)
+
+# 合成データの名前の接頭辞。既存のデータと重ならないようにする
+SYNTHETIC_NAME_PREFIX = "sim"
+
+
+class RecordingLineBotApi(object):
+    '''送信せずに、プッシュメッセージを使用中の時計の日時と合わせて記録するLINE APIの代わり'''
+
+    def __init__(self):
+        # (送信日時, 宛先, メッセージのリスト)のリスト
+        self.pushed_message_list = []
+
+    def push_message(self, to, messages, timeout=None):
+        '''プッシュメッセージを記録する'''
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        self.pushed_message_list.append(
+            (get_current_datetime(), to, list(messages)))
+
+
+class SyntheticDataShard(object):
+    '''合成データのグループのみを担当するタスク確認のシャード。TaskCheckShardの代わりにTaskChecker.executeに渡す。
+    既存のデータを確認の対象にしたりロックしたりせず、本番の確認とは別の名前のリースを用いる'''
+
+    def __str__(self):
+        return SYNTHETIC_NAME_PREFIX
+
+    def filter(self, queryset, group_field="group"):
+        '''クエリセットを合成データのグループのものに絞り込む'''
+        return queryset.filter(**{group_field + "__name__startswith": "{}-group-".format(SYNTHETIC_NAME_PREFIX)})
+
+
+def get_synthetic_deadline_list(task_count: int, now: datetime, deadline_span: timedelta=None)->[datetime]:
+    '''合成タスクの期限のリストを取得する。
+    期間を指定した場合は現在から期間内に均等に、しなければもうすぐと明日を重要度二つごとに交互に割り当てる'''
+    if deadline_span:
+        return [now + deadline_span * (task_idx + 1) / task_count for task_idx in range(task_count)]
+    deadline_list = [now + timedelta(minutes=30), now + timedelta(days=1)]
+    return [deadline_list[task_idx // 2 % len(deadline_list)] for task_idx in range(task_count)]
+
+
+def create_synthetic_dataset(group_count: int, tasks_per_group: int, members_per_group: int, now: datetime, deadline_span: timedelta=None)->[Group]:
+    '''LINEグループに属するグループ、メンバー、タスクを一括で作成する。
+    期間を指定しない場合、タスクは全ての確認(明日のリマインド、明日の重要タスクの確認、もうすぐのリマインドと確認)の対象になるように、
+    重要度と期限(もうすぐ又は明日)を順番に割り当てる。
+    期間を指定した場合は、全グループのタスクの期限を現在から期間内に均等に散らばらせる。
+    一括作成のため、モデルの保存シグナルは送信されない。'''
+    prefix = SYNTHETIC_NAME_PREFIX
+    LineGroup.objects.bulk_create([LineGroup(group_id="{}-line-group-{}".format(prefix, group_idx))
+                                   for group_idx in range(group_count)])
+    line_group_list = list(LineGroup.objects.filter(
+        group_id__startswith="{}-line-group-".format(prefix)).order_by("id"))
+    Group.objects.bulk_create([Group(name="{}-group-{}".format(prefix, group_idx), line_group=line_group)
+                               for group_idx, line_group in enumerate(line_group_list)])
+    group_list = list(Group.objects.filter(
+        name__startswith="{}-group-".format(prefix)).order_by("id"))
+    User.objects.bulk_create([User(name="{}-user-{}-{}".format(prefix, group_idx, member_idx), authority=USER_AUTHORITY_CODE_MAP[UserAuthority.Watcher])
+                              for group_idx in range(group_count) for member_idx in range(members_per_group)])
+    user_map = {user.name: user for user in User.objects.filter(
+        name__startswith="{}-user-".format(prefix))}
+
+    importance_list = [TaskImportance.High, TaskImportance.Middle]
+    if deadline_span:
+        # グループをまたいで順番に期限を割り当てる
+        deadline_list = get_synthetic_deadline_list(
+            group_count * tasks_per_group, now, deadline_span)
+        group_deadlines_list = [deadline_list[group_idx::group_count]
+                                for group_idx in range(group_count)]
+    else:
+        group_deadlines_list = [get_synthetic_deadline_list(
+            tasks_per_group, now)] * group_count
+    Task.objects.bulk_create([Task(name="{}-task-{}-{}".format(prefix, group_idx, task_idx), group=group,
+                                   deadline=group_deadlines_list[group_idx][task_idx],
+                                   importance=TASK_IMPORTANCE_CODE_MAP[importance_list[task_idx % len(importance_list)]])
+                              for group_idx, group in enumerate(group_list) for task_idx in range(tasks_per_group)])
+    task_list = Task.objects.filter(
+        name__startswith="{}-task-".format(prefix))
+
+    # メンバーと参加者を登録する
+    Group.members.through.objects.bulk_create([
+        Group.members.through(group_id=group.id, user_id=user_map["{}-user-{}-{}".format(prefix, group_idx, member_idx)].id)
+        for group_idx, group in enumerate(group_list) for member_idx in range(members_per_group)])
+    group_idx_map = {group.id: group_idx for group_idx,
+                     group in enumerate(group_list)}
+    Task.participants.through.objects.bulk_create([
+        Task.participants.through(task_id=task.id, user_id=user_map["{}-user-{}-{}".format(prefix, group_idx_map[task.group_id], member_idx)].id)
+        for task in task_list for member_idx in range(members_per_group)])
+    return group_list
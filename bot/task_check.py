@@ -1,17 +1,25 @@
 '''タスクの確認に関するクラスなど'''
 
-import fcntl
+import sys
+import time as time_module
+from collections import Counter
 from datetime import datetime, time, timedelta
 from enum import Enum
 
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from linebot.models import TextSendMessage
 
-from . import line
-from .message_commands import CommandSource, add_message_command_group
+from .clock import get_current_datetime
+from .line.outbound_messages import PushMessageBuilder
+from .locking import hold_lease, select_for_update_skip_locked
+from .line.outbox import enqueue_push_messages
+from .message_commands import add_message_command_group_to_groups
 from .message_commands.check_task_commands import \
-    disable_task_check_command_if_need
-from .models import Task, TaskImportance, TaskJoinCheckJob
-from .utilities import TIMEZONE_DEFAULT
+    disable_task_check_command_of_groups_if_need
+from .models import (TASK_IMPORTANCE_CODE_MAP, Group, Task, TaskImportance,
+                     TaskJoinCheckJob)
+from .utilities import TIMEZONE_DEFAULT, get_enum_from_environment
 
 # 明日のタスクリマインダーの時刻
 TOMORROW_REMIND_TIME = time(hour=23, tzinfo=TIMEZONE_DEFAULT)
@@ -19,15 +27,59 @@ TOMORROW_REMIND_TIME = time(hour=23, tzinfo=TIMEZONE_DEFAULT)
 TOMORROW_CHECK_TIME = time(hour=12, tzinfo=TIMEZONE_DEFAULT)
 # もうすぐのタスクリマインダーと確認をどれくらい前に行うか
 SOON_REMIND_AND_CHECK_BEFORE = timedelta(hours=1)
-# タスクチェックのロックファイル
-TASK_CHECK_LOCK_FILE = "task_check_lock"
+# タスクチェックのリース名の接頭辞。確認の種類ごとにリースを取得する
+TASK_CHECK_LEASE_NAME_PREFIX = "task_check:"
+# 確認番号の割り当てが他の処理と衝突した場合の最大再試行回数
+MAX_CHECK_NUMBER_ALLOCATION_RETRY_COUNT = 3
+# 期限切れのまとめに載せるグループあたりの最大タスク数。超えた分は件数のみ載せる
+MAX_STALE_TASK_SUMMARY_COUNT = 10
+
+
+class StaleTaskNotificationPolicy(Enum):
+    '''停止中などで確認の時間を逃し、期限が過ぎてしまったタスクの通知方針'''
+    # 通知しない
+    Drop = "Drop"
+    # グループごとに一つのメッセージにまとめて通知する
+    Summarize = "Summarize"
+
+
+# 期限が過ぎてしまったタスクの通知方針
+STALE_TASK_NOTIFICATION_POLICY = get_enum_from_environment(
+    "LBOT_STALE_TASK_NOTIFICATION_POLICY", StaleTaskNotificationPolicy, StaleTaskNotificationPolicy.Summarize)
+
+
+def load_target_task_list(target_task_set)->[Task]:
+    '''通知に必要なグループ、LINEグループ、参加者と合わせて対象タスクを読み込む。
+    タスクの数によらず一定回数のクエリで読み込む。
+    読み込んだタスクはトランザクションの終了までロックし、他のワーカーがロック中のタスクは読み込まない'''
+    return list(select_for_update_skip_locked(target_task_set).select_related("group__line_group").prefetch_related("participants"))
+
+
+def claim_tasks(target_task_set, **finished_flags)->[Task]:
+    '''対象タスクを読み込み、それらのIDを指定して終了フラグを立てる。読み込んだタスクのリストを返す。
+    トランザクション内で用い、送信やログは返したタスクのみを対象にする。
+    途中で条件を満たしたタスクは読み込んでいないので、フラグを立てずに次回の確認に回す'''
+    task_list = load_target_task_list(target_task_set)
+    if task_list:
+        Task.objects.filter(id__in=[task.id for task in task_list]).update(
+            **finished_flags)
+    return task_list
+
+
+def get_group_task_map(task_list: [Task])->{str: [Task]}:
+    '''タスクをLINEグループIDごとにまとめる'''
+    group_task_map = {}
+    for task in task_list:
+        group_task_map.setdefault(
+            task.group.line_group.group_id, []).append(task)
+    return group_task_map
 
 
 def convert_deadline_to_string(deadline):
     '''期限を時間分の文字列に変換'''
     deadline = deadline.astimezone(TIMEZONE_DEFAULT)
     # 期限が今日なら日付を省略する
-    if deadline.date() == datetime.now(TIMEZONE_DEFAULT).date():
+    if deadline.date() == get_current_datetime().date():
         return "{:02d}:{:02d}".format(deadline.hour, deadline.minute)
     else:
         return "{}/{} {:02d}:{:02d}".format(deadline.month, deadline.day, deadline.hour, deadline.minute)
@@ -35,7 +87,7 @@ def convert_deadline_to_string(deadline):
 
 def get_tommorow_range():
     '''明日の日時範囲を取得する'''
-    tommorow = (datetime.now(TIMEZONE_DEFAULT) + timedelta(days=1)).date()
+    tommorow = (get_current_datetime() + timedelta(days=1)).date()
     start_datetime = datetime(
         tommorow.year, tommorow.month, tommorow.day, 0, 0, 0, tzinfo=TIMEZONE_DEFAULT)
     end_datetime = datetime(
@@ -43,6 +95,95 @@ def get_tommorow_range():
     return start_datetime, end_datetime
 
 
+def get_free_check_numbers(used_check_number_set: {int}, count: int)->[int]:
+    '''使われていない最小の確認番号を指定数取得する'''
+    free_check_number_list = []
+    check_number = 1
+    while len(free_check_number_list) < count:
+        if check_number not in used_check_number_set:
+            free_check_number_list.append(check_number)
+        check_number += 1
+    return free_check_number_list
+
+
+def allocate_check_numbers(group_count_map: {int: int})->{int: [int]}:
+    '''グループ(ID)ごとに、指定数の空いている最小の確認番号を割り当てる。
+    確認番号はグループ内で一意。使用中の番号は一回のクエリでまとめて取得する'''
+    group_used_check_numbers_map = {}
+    for group_id, check_number in TaskJoinCheckJob.objects.filter(group__in=list(group_count_map)).values_list("group_id", "check_number"):
+        group_used_check_numbers_map.setdefault(
+            group_id, set()).add(check_number)
+    return {group_id: get_free_check_numbers(group_used_check_numbers_map.get(group_id, set()), count)
+            for group_id, count in group_count_map.items()}
+
+
+def get_or_create_task_check_jobs(task_list: [Task])->{int: TaskJoinCheckJob}:
+    '''タスク(ID)ごとの参加確認ジョブを取得し、なければ確認番号を割り当ててまとめて作成する。
+    他の処理と確認番号が衝突した場合は、割り当てをやり直す'''
+    retry_count = 0
+    while True:
+        task_check_job_map = {task_check_job.task_id: task_check_job for task_check_job in TaskJoinCheckJob.objects.filter(
+            task__in=[task.id for task in task_list])}
+        new_task_list = [
+            task for task in task_list if task.id not in task_check_job_map]
+        group_check_numbers_map = allocate_check_numbers(
+            Counter([task.group_id for task in new_task_list]))
+        group_check_number_iterator_map = {group_id: iter(check_number_list)
+                                           for group_id, check_number_list in group_check_numbers_map.items()}
+        # タスク確認の登録(テストで期限を12時間後にする)
+        new_task_check_job_list = [TaskJoinCheckJob(group=task.group, task=task, check_number=next(group_check_number_iterator_map[task.group_id]),
+                                                    deadline=get_current_datetime() + timedelta(hours=12)) for task in new_task_list]
+        try:
+            with transaction.atomic():
+                TaskJoinCheckJob.objects.bulk_create(new_task_check_job_list)
+            break
+        except IntegrityError:
+            if retry_count >= MAX_CHECK_NUMBER_ALLOCATION_RETRY_COUNT:
+                raise
+            retry_count += 1
+            sys.stderr.write("確認番号の割り当てが他の処理と衝突しました。割り当てをやり直します。({}/{})\n".format(
+                retry_count, MAX_CHECK_NUMBER_ALLOCATION_RETRY_COUNT))
+
+    # 参加者を読み込み済みのタスクを使う
+    task_map = {task.id: task for task in task_list}
+    for task_check_job in task_check_job_map.values():
+        task_check_job.task = task_map[task_check_job.task_id]
+    task_check_job_map.update(
+        {task_check_job.task.id: task_check_job for task_check_job in new_task_check_job_list})
+    return task_check_job_map
+
+
+class TaskCheckShard(object):
+    '''タスク確認のシャード。グループのIDをシャード数で割った余りがインデックスと一致するグループを担当する'''
+
+    def __init__(self, index: int, count: int):
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(
+                "シャードのインデックスは0以上シャード数未満である必要があります。")
+        self.index = index
+        self.count = count
+
+    def __str__(self):
+        return "{}/{}".format(self.index, self.count)
+
+    @staticmethod
+    def parse(shard_str: str)->"TaskCheckShard":
+        '''"インデックス/シャード数"形式の文字列からシャードを作成する'''
+        index_str, count_str = shard_str.split("/")
+        return TaskCheckShard(int(index_str), int(count_str))
+
+    def filter(self, queryset, group_field="group"):
+        '''クエリセットを担当するグループのものに絞り込む'''
+        shard_group_set = Group.objects.annotate(
+            shard_index=F("id") % self.count).filter(shard_index=self.index)
+        return queryset.filter(**{group_field + "__in": shard_group_set})
+
+
+def filter_by_shard(queryset, shard: TaskCheckShard, group_field="group"):
+    '''シャードが指定されていれば担当するグループのものに絞り込む'''
+    return shard.filter(queryset, group_field) if shard else queryset
+
+
 class TaskCheckType(Enum):
     '''タスクチェックのタイプ'''
     # 全リマインド及び確認
@@ -62,111 +203,157 @@ class TaskChecker(object):
 
     def __init__(self):
         self.__handler_map = {
-            TaskCheckType.All: TaskChecker.__execute_all,
+            TaskCheckType.All: self.__execute_all,
             TaskCheckType.TommorowTasksRemind: TaskChecker.__execute_tommorow_tasks_remind,
             TaskCheckType.TommorowImportantTasksCheck: TaskChecker.__execute_tommorow_important_tasks_check,
             TaskCheckType.SoonTasksRemindAndCheck: TaskChecker.__execute_soon_tasks_remind_and_check,
             TaskCheckType.ProcessOverDueTask: TaskChecker.__exectte_process_overdue_task,
         }
 
-    def __execute(self, task_check_type, force):
-        '''確認を実行'''
-        self.__handler_map[task_check_type](force)
+    def __execute(self, task_check_type, force, shard):
+        '''確認を実行し、(確認の種類, 対象タスク数, 実行時間(秒))のリストを返す。実行しなかった場合の対象タスク数はNone'''
+        if task_check_type == TaskCheckType.All:
+            return self.__execute_all(force, shard)
+        # 複数のプロセスやサーバーから同時に呼ばれた場合に同じ処理が複数回行われることを防ぐため、確認の種類とシャードごとにリースを取得する
+        lease_name = TASK_CHECK_LEASE_NAME_PREFIX + task_check_type.value
+        if shard:
+            lease_name += ":" + str(shard)
+        start_time = time_module.perf_counter()
+        with hold_lease(lease_name) as is_acquired:
+            if not is_acquired:
+                print("他のプロセスが実行中なので確認({})を行いませんでした。".format(
+                    lease_name[len(TASK_CHECK_LEASE_NAME_PREFIX):]))
+                return [(task_check_type, None, 0)]
+            task_count = self.__handler_map[task_check_type](force, shard)
+        return [(task_check_type, task_count, time_module.perf_counter() - start_time)]
 
     @staticmethod
-    def execute(task_check_type, force=False):
-        '''確認を実行'''
-        # Djangoの複数プロセスから同時に呼ばれた場合に同じ処理が複数回行われることを防ぐため、ファイルによる排他ロックを行う
-        with open(TASK_CHECK_LOCK_FILE, "w") as lock_file:
-            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
-            TaskChecker().__execute(task_check_type, force)
-            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
-
-    @classmethod
-    def __execute_all(cls, force):
+    def execute(task_check_type, force=False, shard: TaskCheckShard=None):
+        '''確認を実行し、(確認の種類, 対象タスク数, 実行時間(秒))のリストを返す。
+        シャードを指定した場合は担当するグループのタスクのみ確認する'''
+        return TaskChecker().__execute(task_check_type, force, shard)
+
+    def __execute_all(self, force, shard):
         '''全てのタスクを行う'''
-        cls.__exectte_process_overdue_task(force)
-        cls.__execute_tommorow_tasks_remind(force)
-        cls.__execute_tommorow_important_tasks_check(force)
-        cls.__execute_soon_tasks_remind_and_check(force)
+        return self.__execute(TaskCheckType.ProcessOverDueTask, force, shard) + \
+            self.__execute(TaskCheckType.TommorowTasksRemind, force, shard) + \
+            self.__execute(TaskCheckType.TommorowImportantTasksCheck, force, shard) + \
+            self.__execute(TaskCheckType.SoonTasksRemindAndCheck, force, shard)
 
     @staticmethod
-    def __execute_tommorow_tasks_remind(force):
-        '''明日が期限の全てのタスクを通知(グループのみ)'''
+    def __execute_tommorow_tasks_remind(force, shard):
+        '''明日が期限の全てのタスクを通知(グループのみ)。戻り値は対象タスク数'''
         # リマインド時間前なら何もしない
-        if not force and TOMORROW_REMIND_TIME > datetime.now(TIMEZONE_DEFAULT).timetz():
-            return
+        if not force and TOMORROW_REMIND_TIME > get_current_datetime().timetz():
+            return 0
         # 明日が期限でリマインドが終わってないタスクを探す
-        target_task_set = Task.objects.filter(
-            deadline__range=get_tommorow_range(), group__isnull=False, is_tomorrow_remind_finished=False)
-        # タスクのリマインドを実行
-        TaskChecker.__remind_tasks(
-            target_task_set, "こんばんは。明日が期限のタスクは以下のとおりだよ。", "おやすみなさい:D")
-        # タスクをリマインド済みにする
-        target_task_set.update(is_tomorrow_remind_finished=True)
+        target_task_set = filter_by_shard(Task.objects.filter(
+            deadline__range=get_tommorow_range(), group__isnull=False, is_tomorrow_remind_finished=False), shard)
+        # タスクをリマインド済みにして、同じトランザクションでリマインドを送信待ちに記録する
+        with transaction.atomic():
+            target_task_list = claim_tasks(
+                target_task_set, is_tomorrow_remind_finished=True)
+            message_builder = PushMessageBuilder()
+            TaskChecker.__remind_tasks(
+                message_builder, target_task_list, "こんばんは。明日が期限のタスクは以下のとおりだよ。", "おやすみなさい:D")
+            enqueue_push_messages(message_builder)
         # リマインドしたタスクがあったらログに残す
-        if target_task_set.exists():
+        if target_task_list:
             print("明日のタスク{}件のリマインドを実行。({})".format(
-                target_task_set.count(), datetime.now(TIMEZONE_DEFAULT)))
+                len(target_task_list), get_current_datetime()))
+        return len(target_task_list)
 
     @staticmethod
-    def __execute_tommorow_important_tasks_check(force):
-        '''明日が期限の重要度高タスクを通知(グループのみ)'''
+    def __execute_tommorow_important_tasks_check(force, shard):
+        '''明日が期限の重要度高タスクを通知(グループのみ)。戻り値は対象タスク数'''
         # 確認時間前なら何もしない
-        if not force and TOMORROW_CHECK_TIME > datetime.now(TIMEZONE_DEFAULT).timetz():
-            return
+        if not force and TOMORROW_CHECK_TIME > get_current_datetime().timetz():
+            return 0
         # 明日が期限の確認していない重要タスクを取得する
-        target_task_set = Task.objects.filter(deadline__range=get_tommorow_range(
-        ), importance=TaskImportance.High.name, group__isnull=False, is_tomorrow_check_finished=False)
-        # タスクの参加確認を実行
-        TaskChecker.__check_tasks(
-            target_task_set, "こんにちは。\n重要なタスク「{}」が明日の{}からあるよ。", "こんにちは。明日が期限の重要なタスクは以下のとおりだよ。")
-        # タスクを確認済みにする
-        target_task_set.update(is_tomorrow_check_finished=True)
+        target_task_set = filter_by_shard(Task.objects.filter(deadline__range=get_tommorow_range(
+        ), importance=TASK_IMPORTANCE_CODE_MAP[TaskImportance.High], group__isnull=False, is_tomorrow_check_finished=False), shard)
+        # タスクを確認済みにして、同じトランザクションで参加確認を送信待ちに記録する
+        with transaction.atomic():
+            target_task_list = claim_tasks(
+                target_task_set, is_tomorrow_check_finished=True)
+            message_builder = PushMessageBuilder()
+            TaskChecker.__check_tasks(
+                message_builder, target_task_list, "こんにちは。\n重要なタスク「{}」が明日の{}からあるよ。", "こんにちは。明日が期限の重要なタスクは以下のとおりだよ。")
+            enqueue_push_messages(message_builder)
         # 確認したタスクがあったらログに残す
-        if target_task_set.exists():
+        if target_task_list:
             print("明日の重要タスク{}件の新たな参加確認を実行({})。".format(
-                target_task_set.count(), datetime.now(TIMEZONE_DEFAULT)))
+                len(target_task_list), get_current_datetime()))
+        return len(target_task_list)
 
     @staticmethod
-    def __execute_soon_tasks_remind_and_check(force):
-        '''もうすぐのタスクのリマインド(重要度中)とチェック(重要度高)(グループのみ)'''
+    def __execute_soon_tasks_remind_and_check(force, shard):
+        '''もうすぐのタスクのリマインド(重要度中)とチェック(重要度高)(グループのみ)。戻り値は対象タスク数。
+        停止中などで確認の時間を逃して期限が過ぎてしまったタスクは、方針に従って破棄するかグループごとにまとめて通知する'''
+        now = get_current_datetime()
+        soon_task_set = Task.objects.filter(deadline__gte=now, deadline__lte=now + SOON_REMIND_AND_CHECK_BEFORE,
+                                            group__isnull=False, is_soon_check_finished=False)
         # 期限もうすぐの重要度中でリマインド終わってないタスクを取得する
-        target_remind_task_set = Task.objects.filter(
-            deadline__lte=datetime.now(TIMEZONE_DEFAULT) + SOON_REMIND_AND_CHECK_BEFORE, group__isnull=False, importance=TaskImportance.Middle.name, is_soon_check_finished=False)
-        TaskChecker.__remind_tasks(
-            target_remind_task_set, "やあ。期限が近づいてるタスクがあるよ。", "忘れないようにね:-)")
+        target_remind_task_set = filter_by_shard(soon_task_set.filter(
+            importance=TASK_IMPORTANCE_CODE_MAP[TaskImportance.Middle]), shard)
         # 期限もうすぐの重要度高でリマインド終わってないタスクを取得する
-        target_check_task_set = Task.objects.filter(
-            deadline__lte=datetime.now(TIMEZONE_DEFAULT) + SOON_REMIND_AND_CHECK_BEFORE, group__isnull=False, importance=TaskImportance.High.name, is_soon_check_finished=False)
-        TaskChecker.__check_tasks(
-            target_check_task_set, "おい。\n重要なタスク「{}」が{}からあるよ。", "はい。期限の近い重要なタスクがあるよ。")
-        # タスクをリマインド済みにする
-        target_remind_task_set.update(is_soon_check_finished=True)
-        # タスクを確認済みにする
-        target_check_task_set.update(is_soon_check_finished=True)
+        target_check_task_set = filter_by_shard(soon_task_set.filter(
+            importance=TASK_IMPORTANCE_CODE_MAP[TaskImportance.High]), shard)
+        # 確認しないまま期限が過ぎてしまったタスクを取得する
+        stale_task_set = filter_by_shard(Task.objects.filter(deadline__lt=now, group__isnull=False, importance__in=(
+            TASK_IMPORTANCE_CODE_MAP[TaskImportance.High], TASK_IMPORTANCE_CODE_MAP[TaskImportance.Middle]), is_soon_check_finished=False).order_by("deadline"), shard)
+        # タスクをリマインド済みと確認済みにして、同じトランザクションでメッセージをグループごとにまとめて送信待ちに記録する
+        with transaction.atomic():
+            stale_task_list = claim_tasks(
+                stale_task_set, is_soon_check_finished=True)
+            target_remind_task_list = claim_tasks(
+                target_remind_task_set, is_soon_check_finished=True)
+            target_check_task_list = claim_tasks(
+                target_check_task_set, is_soon_check_finished=True)
+            message_builder = PushMessageBuilder()
+            if STALE_TASK_NOTIFICATION_POLICY == StaleTaskNotificationPolicy.Summarize:
+                TaskChecker.__summarize_stale_tasks(
+                    message_builder, stale_task_list)
+            TaskChecker.__remind_tasks(
+                message_builder, target_remind_task_list, "やあ。期限が近づいてるタスクがあるよ。", "忘れないようにね:-)")
+            TaskChecker.__check_tasks(
+                message_builder, target_check_task_list, "おい。\n重要なタスク「{}」が{}からあるよ。", "はい。期限の近い重要なタスクがあるよ。")
+            enqueue_push_messages(message_builder)
         # リマインドや確認したものがあったらログに残す
-        if target_remind_task_set.exists() or target_check_task_set.exists():
-            print("もうすぐのタスク{}件のリマインドと重要タスク{}件の確認を実行。({})".format(target_remind_task_set.count(), target_check_task_set.count(),
-                                                                 datetime.now(TIMEZONE_DEFAULT)))
+        if target_remind_task_list or target_check_task_list:
+            print("もうすぐのタスク{}件のリマインドと重要タスク{}件の確認を実行。({})".format(len(target_remind_task_list), len(target_check_task_list),
+                                                                 now))
+        if stale_task_list:
+            print("確認の時間を逃して期限が過ぎたタスク{}件を{}。({})".format(len(stale_task_list),
+                                                      "まとめて通知" if STALE_TASK_NOTIFICATION_POLICY == StaleTaskNotificationPolicy.Summarize else "破棄", now))
+        return len(target_remind_task_list) + len(target_check_task_list) + len(stale_task_list)
 
     @staticmethod
-    def __remind_tasks(target_task_set, start_messege, end_message):
-        '''タスクのリマインドを行う'''
+    def __summarize_stale_tasks(message_builder, stale_task_list):
+        '''期限が過ぎてしまったタスクを、グループごとに一つのメッセージにまとめて追加する'''
+        for line_group_id, task_list in get_group_task_map(stale_task_list).items():
+            mess = "ごめんね。お知らせできないうちに期限が過ぎてしまったタスクがあるよ。\n"
+            for task in task_list[:MAX_STALE_TASK_SUMMARY_COUNT]:
+                mess += "■{}(期限: {})\n".format(task.name,
+                                               convert_deadline_to_string(task.deadline))
+            if len(task_list) > MAX_STALE_TASK_SUMMARY_COUNT:
+                mess += "他{}件\n".format(len(task_list) -
+                                         MAX_STALE_TASK_SUMMARY_COUNT)
+            mess = mess.rstrip("\n")
+            message_builder.add(
+                line_group_id, TextSendMessage(text=mess))
+
+    @staticmethod
+    def __remind_tasks(message_builder, target_task_list, start_messege, end_message):
+        '''タスクのリマインドのメッセージを追加する'''
         # 対象タスクをグループごとにまとめる
-        group_task_map = {}
-        for task in target_task_set:
-            group = task.group
-            if group.line_group.group_id in group_task_map:
-                group_task_map[group.line_group.group_id].append(task)
-            else:
-                group_task_map[group.line_group.group_id] = [task]
+        group_task_map = get_group_task_map(target_task_list)
 
         for line_group_id, task_list in group_task_map.items():
-            # 開始メッセージを送信
-            line.api.push_message(
+            # 開始メッセージを追加
+            message_builder.add(
                 line_group_id, TextSendMessage(text=start_messege))
-            # タスク確認を送信
+            # タスク確認を追加
             mess = ""
             for task in task_list:
                 mess += "■{}(期限: {})\n".format(task.name,
@@ -174,42 +361,24 @@ class TaskChecker(object):
                 mess += "メンバー：{}\n".format(
                     "、".join([member.name for member in task.participants.all()]))
             mess = mess.rstrip("\n")
-            line.api.push_message(
+            message_builder.add(
                 line_group_id, TextSendMessage(text=mess))
-            # 終了メッセージを送信
-            line.api.push_message(
+            # 終了メッセージを追加
+            message_builder.add(
                 line_group_id, TextSendMessage(text=end_message))
 
     @staticmethod
-    def __check_tasks(target_task_set, start_messege_single, start_messege_alone_multi):
-        '''タスクの参加確認を行う'''
+    def __check_tasks(message_builder, target_task_list, start_messege_single, start_messege_alone_multi):
+        '''タスクの参加確認を開始し、確認のメッセージを追加する'''
         # 対象タスクをグループごとにまとめる
-        group_task_map = {}
-        for task in target_task_set:
-            group = task.group
-            if group.line_group.group_id in group_task_map:
-                group_task_map[group.line_group.group_id].append(task)
-            else:
-                group_task_map[group.line_group.group_id] = [task]
+        group_task_map = get_group_task_map(target_task_list)
+        # 確認タスクをまとめて取得又は作成する
+        task_check_job_map = get_or_create_task_check_jobs(target_task_list)
 
         # グループごとに通知
         for line_group_id, task_list in group_task_map.items():
-            group = line.utilities.get_group_by_line_group_id_from_database(
-                line_group_id)
-            # 確認タスクを追加
-            check_number_count = 1
-            important_task_check_job_list = []
-            for task in task_list:
-                try:
-                    task_check_job = TaskJoinCheckJob.objects.get(task=task)
-                except TaskJoinCheckJob.DoesNotExist:
-                    # 空いている確認番号を探す
-                    while TaskJoinCheckJob.objects.filter(check_number=check_number_count).exists():
-                        check_number_count += 1
-                    # タスク確認の登録(テストで期限を12時間後にする)
-                    task_check_job = TaskJoinCheckJob.objects.create(
-                        group=task.group, task=task, check_number=check_number_count, deadline=datetime.now() + timedelta(hours=12))
-                important_task_check_job_list.append(task_check_job)
+            important_task_check_job_list = [
+                task_check_job_map[task.id] for task in task_list]
             # 確認番号で並び替え
             ordered_task_check_job_list = [task_check_job for task_check_job in sorted(
                 important_task_check_job_list, key=lambda task_check_job: task_check_job.check_number)]
@@ -220,18 +389,18 @@ class TaskChecker(object):
                 task = task_check_job.task
                 mess = start_messege_single.format(
                     task.name, convert_deadline_to_string(task.deadline))
-                line.api.push_message(
+                message_builder.add(
                     line_group_id, TextSendMessage(text=mess))
                 mess = "メンバーの{}はこのタスクに参加できる？".format(
                     "".join(["「{}」".format(member.name) for member in task.participants.all()]))
-                line.api.push_message(
+                message_builder.add(
                     line_group_id, TextSendMessage(text=mess))
                 mess = "参加できるなら「#できる」、できないなら「#できない」と答えてね。"
-                line.api.push_message(
+                message_builder.add(
                     line_group_id, TextSendMessage(text=mess))
             else:
                 mess = start_messege_alone_multi
-                line.api.push_message(
+                message_builder.add(
                     line_group_id, TextSendMessage(text=mess))
                 # タスク一覧を作成
                 mess = ""
@@ -241,27 +410,30 @@ class TaskChecker(object):
                     mess += "メンバー：{}\n".format(
                         "、".join([member.name for member in task_check_job.task.participants.all()]))
                 mess = mess.rstrip("\n")
-                line.api.push_message(
+                message_builder.add(
                     line_group_id, TextSendMessage(text=mess))
                 mess = "これらのタスクに参加できるかできないか答えてね。"
-                line.api.push_message(
+                message_builder.add(
                     line_group_id, TextSendMessage(text=mess))
                 mess = "例えば、1番のタスクに参加できて2番はできない場合は\n======\n#できる\n1\n======\n#できない\n2\n======\nのように答えてね。"
-                line.api.push_message(
+                message_builder.add(
                     line_group_id, TextSendMessage(text=mess))
 
-            # タスク参加確認を開始
-            add_message_command_group(group, "タスク参加確認")
+        # 通知したグループでまとめてタスク参加確認を開始
+        add_message_command_group_to_groups(
+            [task_list[0].group for task_list in group_task_map.values()], "タスク参加確認")
 
     @staticmethod
-    def __exectte_process_overdue_task(force):
-        '''期限が過ぎたタスクの処理をする'''
+    def __exectte_process_overdue_task(force, shard):
+        '''期限が過ぎたタスクの処理をする。戻り値は対象タスク数'''
         # 対象タスクの期限が過ぎた確認ジョブを削除する
-        overdue_task_check_jobs = TaskJoinCheckJob.objects.filter(
-            task__deadline__lte=datetime.now(TIMEZONE_DEFAULT))
-        # 削除したタスクのグループのタスク家訓コマンドを無効にする
-        for task_check_job in overdue_task_check_jobs.all():
-            if task_check_job.task.group:
-                disable_task_check_command_if_need(
-                    CommandSource(None, task_check_job.task.group))
-        overdue_task_check_jobs.delete()
+        overdue_task_check_jobs = filter_by_shard(TaskJoinCheckJob.objects.filter(
+            task__deadline__lte=get_current_datetime()), shard)
+        overdue_task_check_job_list = list(
+            overdue_task_check_jobs.values_list("id", "task__group_id"))
+        TaskJoinCheckJob.objects.filter(
+            id__in=[task_check_job_id for task_check_job_id, group_id in overdue_task_check_job_list]).delete()
+        # 削除したタスクのグループのうち、確認中のタスクがなくなったグループのタスク確認コマンドをまとめて無効にする
+        disable_task_check_command_of_groups_if_need(
+            list({group_id for task_check_job_id, group_id in overdue_task_check_job_list if group_id is not None}))
+        return len(overdue_task_check_job_list)
@@ -0,0 +1,135 @@
+'''タスクの期限に合わせてタスクの確認を予約するスケジューラ'''
+
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.background import BackgroundScheduler
+from django.db import transaction
+from django.db.models import Min
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .line.outbox import dispatch_outbox_messages
+from .models import (TASK_IMPORTANCE_CODE_MAP, Task, TaskImportance,
+                     TaskJoinCheckJob)
+from .task_check import (SOON_REMIND_AND_CHECK_BEFORE, TOMORROW_CHECK_TIME,
+                         TOMORROW_REMIND_TIME, TaskChecker, TaskCheckShard,
+                         TaskCheckType, filter_by_shard, get_tommorow_range)
+from .utilities import TIMEZONE_DEFAULT
+
+# 確認の最大間隔。予定がない場合や、他のプロセスでタスクが変更された場合もこの間隔で確認する
+MAX_CHECK_INTERVAL = timedelta(hours=1)
+# 確認の最小間隔。確認でエラーが続いた場合に確認を繰り返し続けないようにする
+MIN_CHECK_INTERVAL = timedelta(minutes=1)
+# タスク確認ジョブのID
+TASK_CHECK_JOB_ID = "task_check"
+# 送信待ちメッセージの再送を確認する間隔(分)
+OUTBOX_DISPATCH_INTERVAL = 1
+
+__scheduler = None
+__scheduler_lock = threading.Lock()
+
+
+def get_day_before_at(deadline: datetime, day_time)->datetime:
+    '''期限の前日の指定時刻を取得する'''
+    day_before = deadline.astimezone(TIMEZONE_DEFAULT).date() - timedelta(days=1)
+    return datetime.combine(day_before, day_time)
+
+
+def get_next_check_datetime(now: datetime, shard: TaskCheckShard=None)->datetime:
+    '''次にタスクの確認が必要になる日時を取得する。過ぎていればすぐに確認が必要。
+    シャードを指定した場合は担当するグループのタスクのみ考慮する'''
+    tommorow_start = get_tommorow_range()[0]
+    group_task_set = filter_by_shard(
+        Task.objects.filter(group__isnull=False), shard)
+    due_datetime_list = [now + MAX_CHECK_INTERVAL]
+    # 明日以降が期限でリマインドしていないタスクは、期限の前日のリマインド時刻
+    deadline = group_task_set.filter(deadline__gte=tommorow_start, is_tomorrow_remind_finished=False).aggregate(
+        Min("deadline"))["deadline__min"]
+    if deadline:
+        due_datetime_list.append(
+            get_day_before_at(deadline, TOMORROW_REMIND_TIME))
+    # 明日以降が期限で確認していない重要タスクは、期限の前日の確認時刻
+    deadline = group_task_set.filter(deadline__gte=tommorow_start, importance=TASK_IMPORTANCE_CODE_MAP[TaskImportance.High], is_tomorrow_check_finished=False).aggregate(
+        Min("deadline"))["deadline__min"]
+    if deadline:
+        due_datetime_list.append(
+            get_day_before_at(deadline, TOMORROW_CHECK_TIME))
+    # もうすぐの確認やリマインドをしていないタスクは、期限の少し前
+    deadline = group_task_set.filter(importance__in=(TASK_IMPORTANCE_CODE_MAP[TaskImportance.High], TASK_IMPORTANCE_CODE_MAP[TaskImportance.Middle]), is_soon_check_finished=False).aggregate(
+        Min("deadline"))["deadline__min"]
+    if deadline:
+        due_datetime_list.append(deadline - SOON_REMIND_AND_CHECK_BEFORE)
+    # 参加確認中のタスクは、タスクの期限
+    deadline = filter_by_shard(TaskJoinCheckJob.objects.all(), shard).aggregate(
+        Min("task__deadline"))["task__deadline__min"]
+    if deadline:
+        due_datetime_list.append(deadline)
+    return min(due_datetime_list)
+
+
+def task_check_job():
+    '''タスクのリマインドや確認を行い、次の確認を予約するジョブ'''
+    try:
+        TaskChecker.execute(TaskCheckType.All)
+        # 確認で記録されたメッセージをすぐに送信する
+        dispatch_outbox_messages()
+        print("job_executed")
+    finally:
+        rearm(datetime.now(TIMEZONE_DEFAULT) + MIN_CHECK_INTERVAL)
+
+
+def rearm(not_before: datetime=None):
+    '''次の確認日時を計算し直してタスク確認ジョブを予約する。スケジューラが開始されていなければ何もしない'''
+    with __scheduler_lock:
+        if __scheduler is None:
+            return
+        now = datetime.now(TIMEZONE_DEFAULT)
+        try:
+            next_check_datetime = get_next_check_datetime(now)
+        except Exception:
+            sys.stderr.write("次のタスク確認日時の計算でエラーが発生しました。({})\n".format(
+                sys.exc_info()[1]))
+            next_check_datetime = now + MIN_CHECK_INTERVAL
+        next_check_datetime = max(
+            next_check_datetime, not_before or now, now)
+        __scheduler.add_job(task_check_job, "date", run_date=next_check_datetime,
+                            id=TASK_CHECK_JOB_ID, replace_existing=True, misfire_grace_time=None)
+
+
+def start(scheduler):
+    '''スケジューラでタスクの確認を開始する。起動時は溜まっている確認をすぐに行う'''
+    global __scheduler
+    with __scheduler_lock:
+        __scheduler = scheduler
+        scheduler.add_job(task_check_job, "date", run_date=datetime.now(TIMEZONE_DEFAULT),
+                          id=TASK_CHECK_JOB_ID, replace_existing=True, misfire_grace_time=None)
+
+
+def outbox_dispatch_job():
+    '''送信に失敗した送信待ちメッセージを再送するジョブ'''
+    dispatch_outbox_messages()
+
+
+def create_scheduler(scheduler_class=BackgroundScheduler):
+    '''タスク確認と送信待ちメッセージの送信のジョブを登録したスケジューラを作成する'''
+    # Executorの数を制限しないとデータベースの接続数が増えて上限にひっかかる
+    executors = {
+        'default': ThreadPoolExecutor(1),
+    }
+    scheduler = scheduler_class(executors=executors)
+    # タスクの期限に合わせた確認
+    start(scheduler)
+    # 送信待ちメッセージの定期送信
+    scheduler.add_job(outbox_dispatch_job, "interval",
+                      minutes=OUTBOX_DISPATCH_INTERVAL)
+    return scheduler
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def __rearm_on_task_changed(sender, instance, **kwargs):
+    '''タスクが変更されたら、確定後に次の確認を予約し直す'''
+    transaction.on_commit(rearm)
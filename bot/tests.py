@@ -1,3 +1,51 @@
+from datetime import datetime, timedelta
+
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from .clock import VirtualClock, use_clock
+from .simulation import create_synthetic_dataset
+from .task_check import TaskChecker, TaskCheckType
+from .utilities import TIMEZONE_DEFAULT
+
+# クエリ数を比べる合成データの(グループ数, グループあたりのタスク数)。全ての確認の対象が揃うようにタスクは4つ以上にする
+SMALL_DATASET_SIZE = (2, 4)
+LARGE_DATASET_SIZE = (6, 8)
+# 合成データのグループあたりのメンバー数
+MEMBERS_PER_GROUP = 3
+
+
+class TaskCheckQueryCountTest(TestCase):
+    '''タスク確認のクエリ数がグループ数やタスク数に比例して増えないことを確かめる'''
+
+    @staticmethod
+    def count_task_check_queries(group_count: int, tasks_per_group: int)->(int, int, int):
+        '''合成データで全ての確認と、期限が過ぎた後の期限切れタスクの処理を実行し、(全ての確認のクエリ数, 期限切れタスクの処理のクエリ数, 期限切れとして処理したタスク数)を返す。
+        作成・変更したデータは残さない'''
+        clock = VirtualClock(datetime.now(TIMEZONE_DEFAULT))
+        with use_clock(clock), transaction.atomic():
+            create_synthetic_dataset(
+                group_count, tasks_per_group, MEMBERS_PER_GROUP, clock.now())
+            with CaptureQueriesContext(connection) as all_check_queries:
+                TaskChecker.execute(TaskCheckType.All, True)
+            # 全てのタスクの期限を過ぎさせて、参加確認中のタスクを期限切れとして処理させる
+            clock.advance(timedelta(days=2))
+            with CaptureQueriesContext(connection) as over_due_queries:
+                ((_, over_due_task_count, _),) = TaskChecker.execute(
+                    TaskCheckType.ProcessOverDueTask, True)
+            transaction.set_rollback(True)
+        return len(all_check_queries), len(over_due_queries), over_due_task_count
 
-# Create your tests here.
+    def test_query_count_is_independent_of_dataset_size(self):
+        small_all_check_query_count, small_over_due_query_count, small_over_due_task_count = self.count_task_check_queries(
+            *SMALL_DATASET_SIZE)
+        large_all_check_query_count, large_over_due_query_count, large_over_due_task_count = self.count_task_check_queries(
+            *LARGE_DATASET_SIZE)
+        # 期限切れタスクの処理が実際に行われていることを確認する
+        self.assertGreater(small_over_due_task_count, 0)
+        self.assertGreater(large_over_due_task_count, small_over_due_task_count)
+        self.assertEqual(small_all_check_query_count,
+                         large_all_check_query_count)
+        self.assertEqual(small_over_due_query_count,
+                         large_over_due_query_count)
@@ -1,7 +1,9 @@
 '''ユーティリティ関数'''
 
 import datetime
+import os
 import re
+import sys
 
 # 日本時間
 TIMEZONE_JST = datetime.timezone(datetime.timedelta(hours=+9), 'JST')
@@ -21,22 +23,39 @@ def split_command_paramater_strig(command_parameter_string: str)->[str]:
     return [item for item in re.split(r"、|,", command_parameter_string) if item]
 
 
-def remove_from_comma_separeted_string(command_separated_string: str, item: str):
-    '''カンマ区切り文字列から指定した要素を除去する'''
-    items = split_command_paramater_strig(command_separated_string)
-    if item in items:
-        items.remove(item)
-    return ",".join(items)
-
-
-def add_to_comma_separeted_string(command_separated_string: str, item: str):
-    '''カンマ区切り文字列に指定した要素を追加する'''
-    items = split_command_paramater_strig(command_separated_string)
-    if item not in items:
-        items.append(item)
-    return ",".join(items)
-
-
 def convert_datetime_in_default_timezone_to_string(date_time: datetime.datetime):
     '''日時をデフォルトのタイムゾーンで文字列に変換する'''
     return date_time.astimezone(TIMEZONE_DEFAULT).strftime('%Y/%m/%d %H:%M:%S')
+
+
+def get_bool_from_environment(name: str, default: bool=False)->bool:
+    '''0か1が設定された環境変数を真偽値として取得する。不正な値の場合はデフォルト値を用いる'''
+    try:
+        return bool(int(os.getenv(name, "1" if default else "0")))
+    except ValueError:
+        sys.stderr.write(
+            '環境変数"{}"の値が不正です。0か1である必要があります。デフォルト値({})を用います。\n'.format(name, int(default)))
+        return default
+
+
+def get_number_from_environment(name: str, number_type, default, minimum=0):
+    '''数値が設定された環境変数をnumber_type(intかfloat)の値として取得する。不正な値や最小値未満の場合はデフォルト値を用いる'''
+    try:
+        value = number_type(os.getenv(name, str(default)))
+        if value >= minimum:
+            return value
+    except ValueError:
+        pass
+    sys.stderr.write(
+        '環境変数"{}"の値が不正です。{}以上の数値である必要があります。デフォルト値({})を用います。\n'.format(name, minimum, default))
+    return default
+
+
+def get_enum_from_environment(name: str, enum_class, default):
+    '''列挙型のメンバーの値が設定された環境変数を列挙型のメンバーとして取得する。不正な値の場合はデフォルト値を用いる'''
+    try:
+        return enum_class(os.getenv(name, default.value))
+    except ValueError:
+        sys.stderr.write(
+            '環境変数"{}"の値が不正です。{}のいずれかである必要があります。デフォルト値({})を用います。\n'.format(name, "、".join([member.value for member in enum_class]), default.value))
+        return default
@@ -2,9 +2,15 @@ from django.http import HttpResponse
 from django.shortcuts import render
 
 from .line import event_handlers as event_handlers
+from .line import line_settings, webhook_queue
 
 
 def callback(request):
-    event_handlers.event_handler.handle(request.body.decode('utf-8'),
-                                        request.META["HTTP_" + "X_LINE_SIGNATURE"])  # 元はX-Line-Signature
+    body = request.body.decode('utf-8')
+    signature = request.META["HTTP_" + "X_LINE_SIGNATURE"]  # 元はX-Line-Signature
+    if line_settings.ENABLE_ASYNC_WEBHOOK:
+        # キューに積んだらすぐに応答し、イベントの処理はワーカーに任せる
+        webhook_queue.enqueue(body, signature)
+    else:
+        event_handlers.event_handler.handle(body, signature)
     return HttpResponse()
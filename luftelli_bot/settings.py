@@ -15,6 +15,8 @@ import sys
 
 import dj_database_url
 
+from bot.utilities import get_bool_from_environment
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -33,6 +35,11 @@ except ValueError:
         '環境変数"LBOT_ENABLE_DEBUG_MODE"の値が不正です。"LBOT_ENABLE_DEBUG_MODE"は0か1である必要があります。デバッグモードは無効の状態で開始します。\n')
     DEBUG = False
 
+# タスク確認などの定期ジョブをWebサーバーのプロセス内で実行するかどうか。
+# 無効にした場合は"python manage.py run_scheduler"を別プロセスで起動する
+ENABLE_IN_PROCESS_SCHEDULER = get_bool_from_environment(
+    "LBOT_ENABLE_IN_PROCESS_SCHEDULER", True)
+
 # デプロイ後のアクセス時の"Invalid HTTP_HOST header" 対策でherokuのアプリURLを追加
 ALLOWED_HOSTS = ["luftelli-bot.herokuapp.com"]
 